@@ -1,10 +1,16 @@
 import os
 import json
+import secrets
 from pathlib import Path
 
 DEFAULT_CONFIG = {
     "maya_host": "127.0.0.1",
     "maya_port": 7001,
+    "triposr_daemon": True,
+    "triposr_host": "127.0.0.1",
+    "triposr_port": 7002,
+    "triposr_job_timeout": 1800.0,
+    "rembg_model": "u2net",
 }
 
 
@@ -20,6 +26,36 @@ def load_config():
     except Exception:
         return DEFAULT_CONFIG
 
+def get_triposr_authkey() -> str:
+    """
+    Key shared by the TripoSR worker and its clients. Generated on first
+    use and stored in the user config, readable by the user only, so the
+    viewer and the Maya toolbar agree on it and nobody else knows it.
+    """
+    key = load_config().get("triposr_authkey")
+    if key:
+        return str(key)
+
+    key = secrets.token_hex(32)
+    user_cfg = {}
+    if os.path.exists(CONFIG_PATH):
+        try:
+            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                user_cfg = json.load(f)
+        except Exception:
+            # do not overwrite a config the user has to fix, the key then
+            # only lives as long as this process
+            return key
+
+    user_cfg["triposr_authkey"] = key
+    os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
+    tmp_path = CONFIG_PATH + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(user_cfg, f, indent=4)
+    os.replace(tmp_path, CONFIG_PATH)
+    return key
+
 def find_repo_root_from(start: Path) -> Path:
     start = start.resolve()
     for p in [start, *start.parents]:
@@ -51,3 +87,4 @@ FRAMES_DIR  = str(Path(OUTPUT_DIR) / "frames")
 
 TRIPOSR_DIR = str(Path(MODELS_DIR) / "TripoSR")
 TRIPOSR_RUN = str(Path(TRIPOSR_DIR) / "run.py")
+TRIPOSR_SERVE = str(Path(TRIPOSR_DIR) / "serve.py")
@@ -3,7 +3,7 @@
 """
 Full pipeline for generating a 3D model:
 1. Export cropped object using Rembg
-2. Run TripoSR via CLI
+2. Run TripoSR on the warm worker (or via CLI)
 3. Import into Maya if its port is open
 """
 
@@ -13,7 +13,9 @@ import subprocess
 import sys
 import cv2
 from comfybridge.core.io_utils import export_object_with_rembg, generate_multiview_images
+from comfybridge.core.rembg_session import REMBG_MODEL
 from comfybridge.core.maya_bridge import is_maya_running, import_obj_into_maya
+from comfybridge.core.triposr_daemon import DAEMON_ENABLED, start_daemon, submit_job
 from comfybridge.config import TRIPOSR_RUN, OUTPUT_DIR
 
 
@@ -27,24 +29,50 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # Run TripoSR
 
+def triposr_args(input_png: str) -> list:
+    """Arguments for one TripoSR generation, shared by the worker and the CLI."""
+
+    views = generate_multiview_images(input_png, OUTPUT_DIR)
+
+    args = list(views)
+    args.extend([
+        "--output-dir",
+        OUTPUT_DIR,
+        "--batch-size",
+        str(len(views)),
+        "--ensemble",
+        "--mirrored",
+        "1",  # view_flip.png, see generate_multiview_images
+        "--render",
+        "--rembg-model",
+        REMBG_MODEL,
+    ])
+    return args
+
+
+def run_triposr_daemon(input_png: str) -> str:
+    """Run TripoSR on the long-lived worker, starting it if needed."""
+
+    if not start_daemon(wait=True):
+        raise ConnectionError("TripoSR worker is not available.")
+
+    result = submit_job(triposr_args(input_png))
+
+    if not result["mesh_paths"]:
+        raise RuntimeError("Mesh generation finished but no obj file.")
+
+    return result["mesh_paths"][-1]
+
+
 def run_triposr_cli(input_png: str) -> str:
     
-    views = generate_multiview_images(input_png, OUTPUT_DIR)
-   
-     
     cmd = [
         PYTHON_EXE,
         TRIPOSR_RUN,
     ]
 
    
-    cmd.extend(views)
-    cmd.extend([
-        "--output-dir",
-        OUTPUT_DIR,
-        "--render",
-        
-    ])
+    cmd.extend(triposr_args(input_png))
 
 
     process = subprocess.Popen(
@@ -80,6 +108,18 @@ def run_triposr_cli(input_png: str) -> str:
     return newest_obj
 
 
+def run_triposr(input_png: str) -> str:
+    """Use the warm worker when enabled, fall back to a one-off CLI run."""
+
+    if DAEMON_ENABLED:
+        try:
+            return run_triposr_daemon(input_png)
+        except (OSError, EOFError) as e:
+            print(f"[TripoSR] Worker unavailable ({e}), running CLI instead.")
+
+    return run_triposr_cli(input_png)
+
+
 def generate_3d_model(full_image_np, mask_np, basename="model",
                       progress_callback=None) -> dict:
 
@@ -95,7 +135,7 @@ def generate_3d_model(full_image_np, mask_np, basename="model",
     if progress_callback:
         progress_callback(40, "Generating 3D model…")
 
-    obj_path = run_triposr_cli(crop_path)
+    obj_path = run_triposr(crop_path)
     
     if progress_callback:
         progress_callback(50, "Cleaning up render alpha…")
@@ -14,6 +14,7 @@ import cv2
 import io
 from PIL import Image
 from PySide6.QtGui import QImage
+from comfybridge.core.rembg_session import get_session
 
 
 
@@ -149,7 +150,8 @@ def export_object_with_rembg(full_image_np, rough_mask_np, output_path,
                              padding_ratio=0.15, min_border_px=4):
     """
     1) Crop using the provided mask.
-    2) Run rembg on that crop (same as original, color-safe).
+    2) Run rembg on that crop (same as original, color-safe),
+       with the shared session of the process.
     3) Use alpha channel from rembg output to:
        - find a tight bounding box,
        - center the object in a square BGRA canvas with padding.
@@ -175,7 +177,7 @@ def export_object_with_rembg(full_image_np, rough_mask_np, output_path,
     if not ok:
         raise RuntimeError("Failed to encode ROI before rembg.")
 
-    result_bytes = remove(encoded.tobytes())
+    result_bytes = remove(encoded.tobytes(), session=get_session())
 
     arr = np.frombuffer(result_bytes, np.uint8)
     out_bgra = cv2.imdecode(arr, cv2.IMREAD_UNCHANGED)
@@ -63,6 +63,7 @@ def import_obj_into_maya(obj_path: str) -> bool:
         import os
         import math
         import sys
+        import json
         
         
         # path env:
@@ -132,6 +133,19 @@ def import_obj_into_maya(obj_path: str) -> bool:
                 
             n_views = 8
             radius = 2.0
+            elevation_deg = 0.0
+            fovy_deg = None
+            
+            # camera rig the frames were rendered with, written by TripoSR
+            rig_path = os.path.join(FRAMES_DIR, "cameras.json")
+            if os.path.isfile(rig_path):
+                with open(rig_path, "r") as f:
+                    rig = json.load(f)
+                n_views = int(rig["n_views"])
+                radius = float(rig["camera_distance"])
+                elevation_deg = float(rig["elevation_deg"])
+                fovy_deg = float(rig["fovy_deg"])
+                
             trs_list = []
             
             
@@ -148,15 +162,23 @@ def import_obj_into_maya(obj_path: str) -> bool:
                 angle_deg = (360.0 / n_views) * i
                 angle_rad = angle_deg * 3.141592653589793 / 180.0
                 
-                x = radius * math.sin(angle_rad)
-                z = radius * math.cos(angle_rad)
+                elevation_rad = elevation_deg * 3.141592653589793 / 180.0
+                
+                x = radius * math.cos(elevation_rad) * math.sin(angle_rad)
+                y = radius * math.sin(elevation_rad)
+                z = radius * math.cos(elevation_rad) * math.cos(angle_rad)
                 
                 cmds.move(0,0,0, cam + ".scalePivot", ".rotatePivot", absolute=True)
-                cmds.rotate(0, angle_deg, 0, cam, absolute=True)
+                cmds.rotate(-elevation_deg, angle_deg, 0, cam, absolute=True)
                 
                 cmds.setAttr(cam + ".translateX", x)
-                cmds.setAttr(cam + ".translateY", 0)
+                cmds.setAttr(cam + ".translateY", y)
                 cmds.setAttr(cam + ".translateZ", z)
+                
+                if fovy_deg is not None:
+                    # square film back, the frames are square
+                    cmds.camera(cam, e=True, horizontalFilmAperture=1.0,
+                                verticalFilmAperture=1.0, verticalFieldOfView=fovy_deg)
 
             camera_list = cmds.ls("BridgeCam_*", type="transform") or []
             
@@ -0,0 +1,54 @@
+# comfybridge/core/rembg_session.py
+
+"""
+Process-wide rembg sessions, one per model name.
+Creating a session loads the model weights into a new ONNX Runtime
+session, which takes longer than removing a background, so it is done
+once per process (ahead of time with warm_up) and reused by every
+generation.
+"""
+
+import threading
+
+from rembg import new_session
+
+from comfybridge.config import load_config
+
+cfg = load_config()
+
+REMBG_MODEL = cfg.get("rembg_model", "u2net")
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+
+def get_session(model_name: str = REMBG_MODEL):
+    """Return the session for model_name, creating it on first use."""
+    with _lock:
+        session = _sessions.get(model_name)
+        if session is None:
+            session = new_session(model_name)
+            _sessions[model_name] = session
+        return session
+
+
+def _warm_up(model_name: str):
+    try:
+        get_session(model_name)
+    except Exception as e:
+        print(f"[rembg] Could not load {model_name}: {e}")
+
+
+def warm_up(model_name: str = REMBG_MODEL, background: bool = True):
+    """
+    Create the session before the first generation needs it.
+    With background=True it loads on a daemon thread, and a get_session
+    call made meanwhile waits for it instead of loading a second copy.
+    """
+    if not background:
+        get_session(model_name)
+        return None
+    thread = threading.Thread(target=_warm_up, args=(model_name,), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,173 @@
+# comfybridge/core/triposr_daemon.py
+
+"""
+Client for the long-lived TripoSR worker (models/TripoSR/serve.py).
+The worker keeps the model loaded between generations, so the viewer
+and the Maya toolbar can share one warm model instead of paying the
+full start-up cost on every click.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client
+
+from comfybridge.config import get_triposr_authkey, load_config, TRIPOSR_SERVE, TRIPOSR_DIR, OUTPUT_DIR
+
+cfg = load_config()
+
+DAEMON_ENABLED = bool(cfg.get("triposr_daemon", True))
+DAEMON_HOST = cfg.get("triposr_host", "127.0.0.1")
+DAEMON_PORT = int(cfg.get("triposr_port", 7002))
+DAEMON_AUTHKEY = get_triposr_authkey().encode("utf-8")
+# longest a generation may take before the worker counts as wedged
+JOB_TIMEOUT = float(cfg.get("triposr_job_timeout", 1800.0))
+
+DAEMON_LOG = os.path.join(OUTPUT_DIR, "triposr_daemon.log")
+
+PYTHON_EXE = sys.executable
+
+_daemon_process = None
+
+
+
+def _connect(timeout: float = None):
+    """
+    Open an authenticated connection to the worker.
+    Client() blocks in the authkey handshake until the single-threaded
+    worker gets to accept(), which can take a whole job, and it ignores
+    socket timeouts. With a timeout, the handshake runs on a helper thread
+    and the caller waits at most that long; a connection that completes
+    later is closed straight away.
+    """
+    if timeout is None:
+        return Client((DAEMON_HOST, DAEMON_PORT), authkey=DAEMON_AUTHKEY)
+
+    lock = threading.Lock()
+    state = {"abandoned": False}
+
+    def connect():
+        try:
+            conn = Client((DAEMON_HOST, DAEMON_PORT), authkey=DAEMON_AUTHKEY)
+        except Exception as e:
+            with lock:
+                state["error"] = e
+            return
+        with lock:
+            if state["abandoned"]:
+                conn.close()
+            else:
+                state["conn"] = conn
+
+    thread = threading.Thread(target=connect, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    with lock:
+        if "conn" in state:
+            return state["conn"]
+        if "error" in state:
+            raise state["error"]
+        state["abandoned"] = True
+    raise TimeoutError("TripoSR worker did not accept the connection in time.")
+
+
+def _request(message: dict, timeout: float = None) -> dict:
+    """
+    Send one message to the worker and wait for its reply. With a timeout,
+    connecting and the reply each give up after it with TimeoutError.
+    """
+    with _connect(timeout) as conn:
+        conn.send(message)
+        if timeout is not None and not conn.poll(timeout):
+            raise TimeoutError("TripoSR worker did not answer in time.")
+        return conn.recv()
+
+
+def is_daemon_running() -> bool:
+    """Check if the TripoSR worker is listening and answering."""
+    try:
+        return bool(_request({"ping": True}, timeout=2.0).get("ok"))
+    except Exception:
+        return False
+
+
+def start_daemon(wait: bool = True, timeout: float = 300.0) -> bool:
+    """
+    Launch the worker in the background if it is not already running.
+    With wait=True, blocks until the model is loaded and the worker answers.
+    """
+    global _daemon_process
+
+    if is_daemon_running():
+        return True
+
+    if _daemon_process is None or _daemon_process.poll() is not None:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        cmd = [
+            PYTHON_EXE,
+            TRIPOSR_SERVE,
+            "--host", DAEMON_HOST,
+            "--port", str(DAEMON_PORT),
+        ]
+        # through the environment, a command line is visible to every user
+        env = dict(os.environ, COMFYBRIDGE_TRIPOSR_AUTHKEY=DAEMON_AUTHKEY.decode("utf-8"))
+        with open(DAEMON_LOG, "w", encoding="utf-8") as log:
+            _daemon_process = subprocess.Popen(
+                cmd,
+                cwd=TRIPOSR_DIR,
+                env=env,
+                stdout=log,
+                stderr=log,
+                creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+            )
+        print(f"[TripoSR] Worker starting, log: {DAEMON_LOG}")
+
+    if not wait:
+        return False
+
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if _daemon_process.poll() is not None:
+            print(f"[TripoSR] Worker exited with code {_daemon_process.returncode}, see {DAEMON_LOG}")
+            return False
+        if is_daemon_running():
+            return True
+        time.sleep(0.5)
+
+    print("[TripoSR] Worker did not come up in time.")
+    return False
+
+
+def stop_daemon() -> bool:
+    """
+    Stop the worker if this process launched it. A worker another client
+    started (e.g. the Maya toolbar) is left running for it. A worker of
+    ours that does not answer, e.g. busy with a job, is terminated.
+    """
+    if _daemon_process is None or _daemon_process.poll() is not None:
+        return False
+
+    try:
+        if _request({"shutdown": True}, timeout=5.0).get("ok"):
+            return True
+    except Exception:
+        pass
+
+    _daemon_process.terminate()
+    return True
+
+
+def submit_job(argv: list, timeout: float = JOB_TIMEOUT) -> dict:
+    """
+    Run one generation on the worker. argv is what run.py would get on
+    the command line. Returns the written paths:
+    {"mesh_paths": [...], "texture_paths": [...], "frame_paths": [...]}
+    Raises TimeoutError when the worker takes longer than timeout seconds,
+    to wait for a connection or for the job.
+    """
+    reply = _request({"argv": [str(a) for a in argv]}, timeout=timeout)
+    if not reply.get("ok"):
+        raise RuntimeError(f"TripoSR failed:\n{reply.get('error')}")
+    return reply["result"]
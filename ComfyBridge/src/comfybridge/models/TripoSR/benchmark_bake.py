@@ -0,0 +1,85 @@
+import argparse
+import time
+
+import numpy as np
+import trimesh
+
+from tsr.bake_texture import (
+    create_baker,
+    make_atlas,
+    rasterize_position_atlas_numpy,
+)
+
+
+def best_time(func, repeats):
+    result, best = None, float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+parser = argparse.ArgumentParser(
+    description="Time the GL and the numpy position atlas rasterizers on one mesh."
+)
+parser.add_argument(
+    "mesh", type=str, nargs="?", default=None,
+    help="Mesh to bake. Default: an icosphere with --subdivisions",
+)
+parser.add_argument(
+    "--subdivisions", type=int, default=5,
+    help="Icosphere subdivisions when no mesh is given. Default: 5",
+)
+parser.add_argument(
+    "--texture-resolution", type=int, nargs="+", default=[512, 1024, 2048],
+    help="Atlas resolutions to time. Default: 512 1024 2048",
+)
+parser.add_argument(
+    "--repeats", type=int, default=3,
+    help="Runs per rasterizer, the best one is reported. Default: 3",
+)
+args = parser.parse_args()
+
+if args.mesh is None:
+    mesh = trimesh.creation.icosphere(subdivisions=args.subdivisions, radius=0.5)
+else:
+    mesh = trimesh.load(args.mesh, force="mesh")
+print(f"{len(mesh.vertices)} vertices, {len(mesh.faces)} faces")
+
+baker = create_baker()
+if baker is None:
+    print("No GL context, timing the numpy rasterizer only.")
+
+for texture_resolution in args.texture_resolution:
+    texture_padding = round(max(2, texture_resolution / 256))
+    atlas = make_atlas(mesh, texture_resolution, texture_padding)
+    atlas_args = (
+        mesh,
+        atlas["vmapping"],
+        atlas["indices"],
+        atlas["uvs"],
+        texture_resolution,
+        texture_padding,
+    )
+    numpy_atlas, numpy_time = best_time(
+        lambda: rasterize_position_atlas_numpy(*atlas_args), args.repeats
+    )
+    line = f"{texture_resolution}: numpy {numpy_time:.3f}s"
+    if baker is not None:
+        gl_atlas, gl_time = best_time(
+            lambda: baker.rasterize_position_atlas(*atlas_args), args.repeats
+        )
+        covered = (gl_atlas[..., 3] > 0) & (numpy_atlas[..., 3] > 0)
+        coverage_diff = np.count_nonzero(
+            (gl_atlas[..., 3] > 0) != (numpy_atlas[..., 3] > 0)
+        )
+        max_diff = np.abs(gl_atlas[covered] - numpy_atlas[covered]).max(initial=0.0)
+        line += (
+            f", gl {gl_time:.3f}s, {coverage_diff} texels covered by one only,"
+            f" max position difference {max_diff:.2e}"
+        )
+    print(line)
+
+if baker is not None:
+    baker.release()
@@ -1,7 +1,11 @@
 import argparse
+import json
 import logging
 import os
+import platform
+import re
 import time
+from typing import Optional
 
 import numpy as np
 import rembg
@@ -9,9 +13,11 @@ import torch
 import xatlas
 from PIL import Image
 
+from tsr.cache import RayBundleCache, SceneCodeCache
+from tsr.mesh_render import render_mesh
 from tsr.system import TSR
-from tsr.utils import remove_background, resize_foreground, save_video
-from tsr.bake_texture import bake_texture
+from tsr.utils import needs_background_removal, remove_background, resize_foreground, save_video
+from tsr.bake_texture import Baker, bake_texture, bake_texture_tiled, create_baker
 
 
 class Timer:
@@ -39,165 +45,554 @@ class Timer:
 
 timer = Timer()
 
+# ray bundles stay in memory across jobs of a long-lived process (serve.py)
+_ray_caches = {}
 
-logging.basicConfig(
-    format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-parser = argparse.ArgumentParser()
-parser.add_argument("image", type=str, nargs="+", help="Path to input image(s).")
-parser.add_argument(
-    "--device",
-    default="cuda:0",
-    type=str,
-    help="Device to use. If no CUDA-compatible device is found, will fallback to 'cpu'. Default: 'cuda:0'",
-)
-parser.add_argument(
-    "--pretrained-model-name-or-path",
-    default="stabilityai/TripoSR",
-    type=str,
-    help="Path to the pretrained model. Could be either a huggingface model id is or a local path. Default: 'stabilityai/TripoSR'",
-)
-parser.add_argument(
-    "--chunk-size",
-    default=8192,
-    type=int,
-    help="Evaluation chunk size for surface extraction and rendering. Smaller chunk size reduces VRAM usage but increases computation time. 0 for no chunking. Default: 8192",
-)
-parser.add_argument(
-    "--mc-resolution",
-    default=128, # mesh rez change here
-    type=int,
-    help="Marching cubes grid resolution. Default: 256"
-)
-parser.add_argument(
-    "--no-remove-bg",
-    action="store_true",
-    help="If specified, the background will NOT be automatically removed from the input image, and the input image should be an RGB image with gray background and properly-sized foreground. Default: false",
-)
-parser.add_argument(
-    "--foreground-ratio",
-    default=0.85,
-    type=float,
-    help="Ratio of the foreground size to the image size. Only used when --no-remove-bg is not specified. Default: 0.85",
-)
-parser.add_argument(
-    "--output-dir",
-    default="output/",
-    type=str,
-    help="Output directory to save the results. Default: 'output/'",
-)
-parser.add_argument(
-    "--model-save-format",
-    default="obj",
-    type=str,
-    choices=["obj", "glb"],
-    help="Format to save the extracted mesh. Default: 'obj'",
-)
-parser.add_argument(
-    "--bake-texture",
-    action="store_true",
-    help="Bake a texture atlas for the extracted mesh, instead of vertex colors",
-)
-parser.add_argument(
-    "--texture-resolution",
-    default=2048,
-    type=int,
-    help="Texture atlas resolution, only useful with --bake-texture. Default: 2048"
-)
-parser.add_argument(
-    "--render",
-    action="store_true",
-    help="If specified, save a NeRF-rendered video. Default: false",
-)
-args = parser.parse_args()
-
-output_dir = args.output_dir
-os.makedirs(output_dir, exist_ok=True)
-
-device = args.device
-if not torch.cuda.is_available():
-    device = "cpu"
-
-timer.start("Initializing model")
-model = TSR.from_pretrained(
-    args.pretrained_model_name_or_path,
-    config_name="config.yaml",
-    weight_name="model.ckpt",
-)
-model.renderer.set_chunk_size(args.chunk_size)
-model.to(device)
-timer.end("Initializing model")
-
-timer.start("Processing images")
-images = []
-
-if args.no_remove_bg:
-    rembg_session = None
-else:
-    rembg_session = rembg.new_session()
-
-for i, image_path in enumerate(args.image):
-    if args.no_remove_bg:
-        image = np.array(Image.open(image_path).convert("RGB"))
+
+def get_ray_cache(cache_dir: str) -> RayBundleCache:
+    if cache_dir not in _ray_caches:
+        _ray_caches[cache_dir] = RayBundleCache(cache_dir)
+    return _ray_caches[cache_dir]
+
+
+# rembg sessions of the process by model name, loading one takes seconds
+_rembg_sessions = {}
+
+
+def get_rembg_session(model_name: str):
+    if model_name not in _rembg_sessions:
+        _rembg_sessions[model_name] = rembg.new_session(model_name)
+    return _rembg_sessions[model_name]
+
+
+# one GL context and its programs for every bake of the process, None
+# without GL, bake_texture then rasterizes the atlas with numpy
+_baker = None
+
+
+def get_baker() -> Optional[Baker]:
+    global _baker
+    if _baker is None:
+        _baker = create_baker()
+    return _baker
+
+
+def release_baker() -> None:
+    global _baker
+    if _baker is not None:
+        _baker.release()
+        _baker = None
+
+
+def chunk_size_arg(value: str):
+    if value in ("auto", "benchmark"):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected an integer, 'auto' or 'benchmark', got {value!r}"
+        )
+
+
+def add_model_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    # arguments needed to build the model, shared with serve.py
+    parser.add_argument(
+        "--device",
+        default="cuda:0",
+        type=str,
+        help="Device to use. If no CUDA-compatible device is found, will fallback to 'cpu'. Default: 'cuda:0'",
+    )
+    parser.add_argument(
+        "--pretrained-model-name-or-path",
+        default="stabilityai/TripoSR",
+        type=str,
+        help="Path to the pretrained model. Could be either a huggingface model id is or a local path. Default: 'stabilityai/TripoSR'",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        default=8192,
+        type=chunk_size_arg,
+        help="Evaluation chunk size for surface extraction and rendering. Smaller chunk size reduces VRAM usage but increases computation time. 0 for no chunking. 'auto' picks the largest size fitting --memory-budget-mb, 'benchmark' times sizes up to that once per machine and remembers the fastest. Default: 8192",
+    )
+    parser.add_argument(
+        "--query-workers",
+        default=0,
+        type=int,
+        help="Threads evaluating query chunks in parallel on CPU, sharing the intra-op threads. 0 to run chunks one after another. Default: 0",
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        default=0,
+        type=int,
+        help="Memory a chunk may use with --chunk-size auto or benchmark. 0 for half of the free VRAM on CUDA, 2048 on CPU. Default: 0",
+    )
+    parser.add_argument(
+        "--chunk-size-cache",
+        default=None,
+        type=str,
+        help="JSON file keeping the --chunk-size benchmark results. Default: 'checkpoints/chunk_size.json' next to run.py",
+    )
+    parser.add_argument(
+        "--snapshot-dir",
+        default=None,
+        type=str,
+        help="Directory of the memory-mappable model snapshot written on first load. Default: 'checkpoints/<model name>' next to run.py",
+    )
+    parser.add_argument(
+        "--no-snapshot",
+        action="store_true",
+        help="If specified, always load the original checkpoint and do not write a snapshot. Default: false",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="If specified, never contact the Hugging Face hub. Model files must be local, cached or in the snapshot. Default: false",
+    )
+    return parser
+
+
+def default_snapshot_dir(pretrained_model_name_or_path: str) -> str:
+    name = re.sub(r"[^A-Za-z0-9._-]+", "--", pretrained_model_name_or_path).strip("-")
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints", name)
+
+
+def memory_budget_bytes(args, device) -> int:
+    if args.memory_budget_mb > 0:
+        return args.memory_budget_mb * 1024 * 1024
+    if str(device).startswith("cuda"):
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free // 2
+    # no portable way to ask for the free RAM
+    return 2048 * 1024 * 1024
+
+
+def resolve_chunk_size(model, args, device) -> int:
+    if isinstance(args.chunk_size, int):
+        return args.chunk_size
+
+    chunk_size = model.renderer.auto_chunk_size(
+        model.decoder, memory_budget_bytes(args, device)
+    )
+    if args.chunk_size == "auto":
+        logging.info(f"Using chunk size {chunk_size}.")
+        return chunk_size
+
+    # benchmarked once per machine, decoder and largest allowed size
+    if str(device).startswith("cuda"):
+        device_name = torch.cuda.get_device_name(torch.device(device))
     else:
-        image = remove_background(Image.open(image_path), rembg_session)
-        image = resize_foreground(image, args.foreground_ratio)
-        image = np.array(image).astype(np.float32) / 255.0
-        image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
-        image = Image.fromarray((image * 255.0).astype(np.uint8))
-        
-            
-        
-        
-    images.append(image)
-timer.end("Processing images")
-
-for i, image in enumerate(images):
-    logging.info(f"Running image {i + 1}/{len(images)} ...")
-
-    timer.start("Running model")
-    with torch.no_grad():
-        scene_codes = model([image], device=device)
-    timer.end("Running model")
-
-    if args.render:
-        frames_dir = os.path.join(output_dir, "frames")
-        os.makedirs(frames_dir, exist_ok=True)
-        timer.start("Rendering")
-        
-        # hard-wired render settings for ComfyBridge:
-        N_VIEWS = 8
-        HEIGHT = 240
-        WIDTH = 240
-        FOVY_DEG = 40.0
-        CAMERA_DISTANCE = 1.9
-        ELEVATION_DEG = 0.0
-        
-        render_images = model.render(scene_codes, n_views=N_VIEWS, height=HEIGHT, width=WIDTH, fovy_deg=FOVY_DEG, camera_distance=CAMERA_DISTANCE, return_type="pil")
-        for ri, render_image in enumerate(render_images[0], start=1):
-            render_image.save(os.path.join(frames_dir, f"render_{ri:03d}.png"))
-        save_video(
-            render_images[0], os.path.join(frames_dir, f"render.mp4"), fps=30
+        device_name = f"cpu-{platform.machine()}-{os.cpu_count()}"
+    key = f"{device_name}|torch-{torch.__version__}|{model.renderer.estimate_point_bytes(model.decoder)}|{chunk_size}"
+    cache_path = args.chunk_size_cache or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "checkpoints", "chunk_size.json"
+    )
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            results = json.load(f)
+    except (OSError, ValueError):
+        results = {}
+    if key not in results:
+        timer.start("Benchmarking chunk sizes")
+        candidates = [1 << k for k in range(12, 23) if 1 << k <= chunk_size]
+        results[key] = model.renderer.benchmark_chunk_size(
+            model.decoder, candidates or [chunk_size], device=device
         )
-        timer.end("Rendering")
+        timer.end("Benchmarking chunk sizes")
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        with open(cache_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        os.replace(cache_path + ".tmp", cache_path)
+    logging.info(f"Using chunk size {results[key]}.")
+    return int(results[key])
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", type=str, nargs="+", help="Path to input image(s).")
+    add_model_arguments(parser)
+    parser.add_argument(
+        "--batch-size",
+        default=1,
+        type=int,
+        help="Number of input images sent through the model in one forward pass. 0 to run all images in a single batch. Default: 1",
+    )
+    parser.add_argument(
+        "--ensemble",
+        action="store_true",
+        help="If specified, treat all input images as views of the same object and fuse their triplanes into one scene code before extracting a single mesh. Default: false",
+    )
+    parser.add_argument(
+        "--mirrored",
+        default=[],
+        type=int,
+        nargs="*",
+        help="Indices of input images that are horizontal flips of the original view. They are un-mirrored before fusion. Only used with --ensemble.",
+    )
+    parser.add_argument(
+        "--mc-resolution",
+        default=128, # mesh rez change here
+        type=int,
+        help="Marching cubes grid resolution. Default: 256"
+    )
+    parser.add_argument(
+        "--mc-method",
+        default="dense",
+        type=str,
+        choices=["dense", "adaptive", "streaming"],
+        help="How the marching cubes grid is evaluated. 'adaptive' starts from a coarse grid and only refines cells near the surface, which makes high --mc-resolution affordable. 'streaming' evaluates and polygonises the grid slab by slab to bound memory. Default: 'dense'",
+    )
+    parser.add_argument(
+        "--mc-workers",
+        default=0,
+        type=int,
+        help="Number of processes polygonising the marching cubes grid in blocks. Pays off at high --mc-resolution. 0 for a single call. Default: 0",
+    )
+    parser.add_argument(
+        "--mc-color-grid",
+        action="store_true",
+        help="If specified, keep the colors decoded with the marching cubes grid and interpolate vertex colors from them instead of querying every vertex again. Only used with --mc-method dense, ignored with --bake-texture. Default: false",
+    )
+    parser.add_argument(
+        "--no-remove-bg",
+        action="store_true",
+        help="If specified, the background will NOT be automatically removed from the input image, and the input image should be an RGB image with gray background and properly-sized foreground. Default: false",
+    )
+    parser.add_argument(
+        "--foreground-ratio",
+        default=0.85,
+        type=float,
+        help="Ratio of the foreground size to the image size. Only used when --no-remove-bg is not specified. Default: 0.85",
+    )
+    parser.add_argument(
+        "--rembg-model",
+        default="u2net",
+        type=str,
+        help="rembg model removing the background of inputs without transparency. Default: 'u2net'",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="output/",
+        type=str,
+        help="Output directory to save the results. Default: 'output/'",
+    )
+    parser.add_argument(
+        "--model-save-format",
+        default="obj",
+        type=str,
+        choices=["obj", "glb"],
+        help="Format to save the extracted mesh. Default: 'obj'",
+    )
+    parser.add_argument(
+        "--bake-texture",
+        action="store_true",
+        help="Bake a texture atlas for the extracted mesh, instead of vertex colors",
+    )
+    parser.add_argument(
+        "--texture-resolution",
+        default=2048,
+        type=int,
+        help="Texture atlas resolution, only useful with --bake-texture. Default: 2048"
+    )
+    parser.add_argument(
+        "--texture-tile-size",
+        default=0,
+        type=int,
+        help="If positive, bake the texture this many rows at a time and stream them to the PNG, keeping memory bounded for 4K/8K atlases. 0 bakes the whole atlas at once. Default: 0"
+    )
+    parser.add_argument(
+        "--render",
+        action="store_true",
+        help="If specified, save turntable frames and a video, see --frame-backend. Default: false",
+    )
+    parser.add_argument(
+        "--frame-backend",
+        default="nerf",
+        type=str,
+        choices=["nerf", "mesh"],
+        help="How --render produces the frames. 'nerf' volume renders the scene code, 'mesh' rasterises the extracted mesh with its colors, which is much faster and matches the geometry sent to Maya. Default: 'nerf'",
+    )
+    parser.add_argument(
+        "--render-n-views",
+        default=8,
+        type=int,
+        help="Number of turntable views rendered with --render. Default: 8",
+    )
+    parser.add_argument(
+        "--render-resolution",
+        default=240,
+        type=int,
+        help="Width and height of the rendered views. Default: 240",
+    )
+    parser.add_argument(
+        "--render-fovy",
+        default=40.0,
+        type=float,
+        help="Vertical field of view of the render cameras, in degrees. Default: 40",
+    )
+    parser.add_argument(
+        "--render-camera-distance",
+        default=1.9,
+        type=float,
+        help="Distance of the render cameras to the object. Default: 1.9",
+    )
+    parser.add_argument(
+        "--render-elevation",
+        default=0.0,
+        type=float,
+        help="Elevation of the render cameras, in degrees. Default: 0",
+    )
+    parser.add_argument(
+        "--no-ray-cache",
+        action="store_true",
+        help="If specified, build the camera rays on every render instead of reusing the cached ones of the same camera rig. Default: false",
+    )
+    parser.add_argument(
+        "--ray-cache-dir",
+        default=None,
+        type=str,
+        help="Directory of the camera ray cache. Default: '<output-dir>/ray_cache'",
+    )
+    parser.add_argument(
+        "--render-occupancy-resolution",
+        default=64,
+        type=int,
+        help="Resolution of the occupancy grid used to skip empty space when rendering. 0 to decode every sample. Default: 64",
+    )
+    parser.add_argument(
+        "--render-occupancy-threshold",
+        default=0.01,
+        type=float,
+        help="Density below which occupancy grid cells count as empty. Default: 0.01",
+    )
+    parser.add_argument(
+        "--render-coarse-samples",
+        default=32,
+        type=int,
+        help="Uniform samples per ray of the coarse rendering pass. 0 to use the model's fixed uniform sampling instead of coarse/fine sampling. Default: 32",
+    )
+    parser.add_argument(
+        "--render-fine-samples",
+        default=32,
+        type=int,
+        help="Samples per ray placed where the coarse pass found density. Only used with --render-coarse-samples > 0. Default: 32",
+    )
+    parser.add_argument(
+        "--render-termination-threshold",
+        default=1e-3,
+        type=float,
+        help="Transmittance below which a ray stops being sampled when rendering with uniform sampling. 0 to composite every sample. Default: 0.001",
+    )
+    parser.add_argument(
+        "--no-scene-cache",
+        action="store_true",
+        help="If specified, always recompute the scene codes instead of reusing cached ones for identical inputs. Default: false",
+    )
+    parser.add_argument(
+        "--scene-cache-dir",
+        default=None,
+        type=str,
+        help="Directory of the scene code cache. Default: '<output-dir>/scene_cache'",
+    )
+    parser.add_argument(
+        "--scene-cache-size-mb",
+        default=1024,
+        type=int,
+        help="Size cap of the scene code cache, least recently used entries are evicted past it. Default: 1024",
+    )
+    return parser
+
 
-    timer.start("Extracting mesh")
-    meshes = model.extract_mesh(scene_codes, not args.bake_texture, resolution=args.mc_resolution)
-    timer.end("Extracting mesh")
+def load_model(args):
+    device = args.device
+    if not torch.cuda.is_available():
+        device = "cpu"
 
-    out_mesh_path = out_mesh_path = os.path.join(output_dir, f"mesh.{args.model_save_format}") # change: hard-wired to single output path.
-    if args.bake_texture:
-        out_texture_path = os.path.join(output_dir, "texture.png") # change: same as above.
+    snapshot_dir = None
+    if not args.no_snapshot:
+        snapshot_dir = args.snapshot_dir or default_snapshot_dir(args.pretrained_model_name_or_path)
 
-        timer.start("Baking texture")
-        bake_output = bake_texture(meshes[0], model, scene_codes[0], args.texture_resolution)
-        timer.end("Baking texture")
+    timer.start("Initializing model")
+    model = TSR.from_pretrained(
+        args.pretrained_model_name_or_path,
+        config_name="config.yaml",
+        weight_name="model.ckpt",
+        snapshot_dir=snapshot_dir,
+        local_files_only=args.offline,
+    )
+    model.to(device)
+    model.renderer.set_chunk_size(resolve_chunk_size(model, args, device))
+    model.renderer.set_num_workers(args.query_workers)
+    timer.end("Initializing model")
+    return model, device
 
-        timer.start("Exporting mesh and texture")
-        xatlas.export(out_mesh_path, meshes[0].vertices[bake_output["vmapping"]], bake_output["indices"], bake_output["uvs"], meshes[0].vertex_normals[bake_output["vmapping"]])
-        Image.fromarray((bake_output["colors"] * 255.0).astype(np.uint8)).transpose(Image.FLIP_TOP_BOTTOM).save(out_texture_path)
-        timer.end("Exporting mesh and texture")
+
+def save_frames(frames: np.ndarray, frames_dir: str, rig: dict) -> list:
+    # (n_views, H, W, 3) uint8 frames as render_XXX.png and a turntable video
+    os.makedirs(frames_dir, exist_ok=True)
+    with open(os.path.join(frames_dir, "cameras.json"), "w") as f:
+        json.dump(rig, f, indent=2)
+    frame_paths = []
+    for ri, frame in enumerate(frames, start=1):
+        frame_path = os.path.join(frames_dir, f"render_{ri:03d}.png")
+        Image.fromarray(frame).save(frame_path)
+        frame_paths.append(frame_path)
+    save_video(list(frames), os.path.join(frames_dir, f"render.mp4"), fps=30)
+    return frame_paths
+
+
+def run(model, device, args, rembg_session=None) -> dict:
+    """
+    Runs one generation with an already initialized model.
+    Returns the paths of everything written to args.output_dir.
+    """
+    output_dir = args.output_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    result = {"mesh_paths": [], "texture_paths": [], "frame_paths": []}
+
+    timer.start("Processing images")
+    images = []
+
+    for i, image_path in enumerate(args.image):
+        if args.no_remove_bg:
+            image = np.array(Image.open(image_path).convert("RGB"))
+        else:
+            image = Image.open(image_path)
+            # inputs cut out upstream carry alpha and need no session at all
+            if rembg_session is None and needs_background_removal(image):
+                rembg_session = get_rembg_session(args.rembg_model)
+            image = remove_background(image, rembg_session)
+            image = resize_foreground(image, args.foreground_ratio)
+            image = np.array(image).astype(np.float32) / 255.0
+            image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
+            image = Image.fromarray((image * 255.0).astype(np.uint8))
+        images.append(image)
+    timer.end("Processing images")
+
+    if args.no_scene_cache:
+        model.set_scene_code_cache(None)
     else:
-        timer.start("Exporting mesh")
-        meshes[0].export(out_mesh_path)
-        timer.end("Exporting mesh")
+        model.set_scene_code_cache(
+            SceneCodeCache(
+                args.scene_cache_dir or os.path.join(output_dir, "scene_cache"),
+                max_bytes=args.scene_cache_size_mb * 1024 * 1024,
+            )
+        )
+
+    if args.no_ray_cache:
+        model.set_ray_cache(None)
+    else:
+        model.set_ray_cache(
+            get_ray_cache(args.ray_cache_dir or os.path.join(output_dir, "ray_cache"))
+        )
+
+    # all views of a batch go through the tokenizer and backbone together
+    batch_size = args.batch_size if args.batch_size > 0 else len(images)
+    all_scene_codes = []
+    for b0 in range(0, len(images), batch_size):
+        batch = images[b0 : b0 + batch_size]
+        logging.info(f"Running images {b0 + 1}-{b0 + len(batch)}/{len(images)} ...")
+
+        timer.start("Running model")
+        with torch.no_grad():
+            all_scene_codes.append(model(batch, device=device))
+        timer.end("Running model")
+    all_scene_codes = torch.cat(all_scene_codes, dim=0)
+
+    if args.ensemble:
+        # one fused scene code, so extraction, rendering and export run once
+        all_scene_codes = model.fuse_scene_codes(all_scene_codes, mirrored=args.mirrored)
+
+    for i in range(all_scene_codes.shape[0]):
+        logging.info(f"Exporting result {i + 1}/{all_scene_codes.shape[0]} ...")
+        scene_codes = all_scene_codes[i : i + 1]
+
+        # camera rig, also read by the Maya import to match the frames
+        rig = {
+            "n_views": args.render_n_views,
+            "elevation_deg": args.render_elevation,
+            "camera_distance": args.render_camera_distance,
+            "fovy_deg": args.render_fovy,
+            "height": args.render_resolution,
+            "width": args.render_resolution,
+        }
+        frames_dir = os.path.join(output_dir, "frames")
+
+        if args.render and args.frame_backend == "nerf":
+            timer.start("Rendering")
+            model.renderer.set_occupancy_grid(
+                args.render_occupancy_resolution, args.render_occupancy_threshold
+            )
+            model.renderer.set_early_termination(args.render_termination_threshold)
+            model.renderer.set_importance_sampling(
+                args.render_coarse_samples, args.render_fine_samples
+            )
+            render_images = model.render(scene_codes, **rig, return_type="stacked")
+            # one conversion for all frames
+            render_images = (render_images[0].clamp(0, 1) * 255.0).to(torch.uint8).cpu().numpy()
+            result["frame_paths"] = save_frames(render_images, frames_dir, rig)
+            timer.end("Rendering")
+
+        timer.start("Extracting mesh")
+        meshes = model.extract_mesh(scene_codes, not args.bake_texture, resolution=args.mc_resolution, method=args.mc_method, num_workers=args.mc_workers, color_grid=args.mc_color_grid)
+        timer.end("Extracting mesh")
+
+        if args.render and args.frame_backend == "mesh":
+            timer.start("Rasterizing frames")
+            if args.bake_texture:
+                # meshes extracted for baking carry no vertex colors
+                with torch.no_grad():
+                    vertex_colors = model.renderer.query_triplane(
+                        model.decoder,
+                        torch.as_tensor(meshes[0].vertices, dtype=torch.float32, device=scene_codes.device),
+                        scene_codes[0],
+                    )["color"].cpu().numpy()
+            else:
+                vertex_colors = meshes[0].visual.vertex_colors[:, :3] / 255.0
+            render_images = render_mesh(meshes[0], vertex_colors, **rig)
+            render_images = (render_images * 255.0).round().astype(np.uint8)
+            result["frame_paths"] = save_frames(render_images, frames_dir, rig)
+            timer.end("Rasterizing frames")
+
+        out_mesh_path = out_mesh_path = os.path.join(output_dir, f"mesh.{args.model_save_format}") # change: hard-wired to single output path.
+        if args.bake_texture:
+            out_texture_path = os.path.join(output_dir, "texture.png") # change: same as above.
+
+            timer.start("Baking texture")
+            if args.texture_tile_size > 0:
+                # written tile by tile while baking
+                bake_output = bake_texture_tiled(meshes[0], model, scene_codes[0], args.texture_resolution, out_texture_path, args.texture_tile_size, get_baker())
+            else:
+                bake_output = bake_texture(meshes[0], model, scene_codes[0], args.texture_resolution, get_baker())
+            timer.end("Baking texture")
+
+            timer.start("Exporting mesh and texture")
+            xatlas.export(out_mesh_path, meshes[0].vertices[bake_output["vmapping"]], bake_output["indices"], bake_output["uvs"], meshes[0].vertex_normals[bake_output["vmapping"]])
+            if "colors" in bake_output:
+                Image.fromarray(bake_output["colors"]).transpose(Image.FLIP_TOP_BOTTOM).save(out_texture_path)
+            timer.end("Exporting mesh and texture")
+            result["texture_paths"].append(out_texture_path)
+        else:
+            timer.start("Exporting mesh")
+            meshes[0].export(out_mesh_path)
+            timer.end("Exporting mesh")
+        result["mesh_paths"].append(out_mesh_path)
+
+    return result
+
+
+def main():
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+    args = build_parser().parse_args()
+    model, device = load_model(args)
+    try:
+        run(model, device, args)
+    finally:
+        release_baker()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Long-lived TripoSR worker.
+
+Loads the model once and runs generation jobs sent over a local socket, so
+every click in ComfyBridge skips the torch import, the model build and the
+checkpoint load. A job is the argument list run.py would get on the command
+line; the reply holds the paths of the written files.
+
+    COMFYBRIDGE_TRIPOSR_AUTHKEY=<key> python serve.py --port 7002
+
+Every message is unpickled, so the worker only starts with a secret key
+that clients must prove they know.
+"""
+
+import argparse
+import logging
+import os
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+
+import torch
+
+from run import (
+    add_model_arguments,
+    build_parser,
+    load_model,
+    release_baker,
+    resolve_chunk_size,
+    run,
+    timer,
+)
+
+
+# model arguments used once at start-up, a job cannot change them
+LOAD_ARGUMENTS = (
+    "device",
+    "pretrained_model_name_or_path",
+    "snapshot_dir",
+    "no_snapshot",
+    "offline",
+)
+
+
+def handle(message, model, device, job_parser, worker_args) -> dict:
+    if message.get("ping"):
+        return {"ok": True}
+
+    # seeded with the worker's values, argparse keeps them unless the job
+    # passes the flag, so any difference was asked for explicitly
+    loaded = {name: getattr(worker_args, name) for name in LOAD_ARGUMENTS}
+    try:
+        args = job_parser.parse_args(message["argv"], argparse.Namespace(**loaded))
+    except SystemExit:
+        # argparse already printed the usage error to stderr
+        return {"ok": False, "error": f"Invalid TripoSR arguments: {message['argv']}"}
+
+    changed = [
+        f"--{name.replace('_', '-')} {getattr(args, name)!r} (worker: {value!r})"
+        for name, value in loaded.items()
+        if getattr(args, name) != value
+    ]
+    if changed:
+        return {
+            "ok": False,
+            "error": "The worker loaded its model at start-up and cannot change "
+            f"{', '.join(changed)}. Restart it with these arguments or run run.py.",
+        }
+
+    try:
+        model.renderer.set_chunk_size(resolve_chunk_size(model, args, device))
+        model.renderer.set_num_workers(args.query_workers)
+        timer.start("Job")
+        result = run(model, device, args)
+        timer.end("Job")
+        return {"ok": True, "result": result}
+    except Exception:
+        logging.exception("TripoSR job failed")
+        return {"ok": False, "error": traceback.format_exc()}
+
+
+def main():
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+    parser = argparse.ArgumentParser()
+    add_model_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1", type=str, help="Address to listen on. Default: '127.0.0.1'")
+    parser.add_argument("--port", default=7002, type=int, help="Port to listen on. Default: 7002")
+    parser.add_argument("--authkey", default=os.environ.get("COMFYBRIDGE_TRIPOSR_AUTHKEY"), type=str, help="Secret key clients must present. Default: the COMFYBRIDGE_TRIPOSR_AUTHKEY environment variable")
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error("no authkey, set COMFYBRIDGE_TRIPOSR_AUTHKEY or pass --authkey")
+
+    model, device = load_model(args)
+    job_parser = build_parser()
+
+    with Listener((args.host, args.port), authkey=args.authkey.encode("utf-8")) as listener:
+        logging.info(f"TripoSR worker listening on {args.host}:{args.port}")
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                logging.warning("Rejected a connection with a wrong authkey.")
+                continue
+            except (EOFError, OSError):
+                # the client gave up waiting before the handshake
+                continue
+
+            with conn:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    continue
+
+                if message.get("shutdown"):
+                    conn.send({"ok": True})
+                    break
+
+                with torch.no_grad():
+                    reply = handle(message, model, device, job_parser, args)
+                try:
+                    conn.send(reply)
+                except OSError:
+                    logging.warning("Client disconnected before the reply was sent.")
+
+    release_baker()
+    logging.info("TripoSR worker stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,154 +1,464 @@
+import hashlib
+import logging
+from collections import OrderedDict
+
 import numpy as np
 import torch
 import xatlas
 import trimesh
-import moderngl
 from PIL import Image
 
+from .rasterize import rasterize
+from .utils import PNGWriter
+
+try:
+    import moderngl
+except ImportError:
+    moderngl = None
+
+
+# charts of the last meshes baked, by mesh_key: the atlas of their first bake
+# and every packing done since, by (texture_resolution, texture_padding)
+_chart_cache = OrderedDict()
+CHART_CACHE_SIZE = 8
+
+
+def mesh_key(mesh):
+    h = hashlib.sha1()
+    for array in (mesh.vertices, mesh.faces):
+        array = np.ascontiguousarray(array)
+        h.update(str((array.shape, array.dtype.str)).encode("utf-8"))
+        h.update(array.tobytes())
+    return h.hexdigest()
+
 
 def make_atlas(mesh, texture_resolution, texture_padding):
-    atlas = xatlas.Atlas()
-    atlas.add_mesh(mesh.vertices, mesh.faces)
+    key = mesh_key(mesh)
+    entry = _chart_cache.pop(key, None)
+    if entry is not None and (texture_resolution, texture_padding) in entry["packs"]:
+        _chart_cache[key] = entry
+        return entry["packs"][texture_resolution, texture_padding]
+
     options = xatlas.PackOptions()
     options.resolution = texture_resolution
     options.padding = texture_padding
     options.bilinear = True
-    atlas.generate(pack_options=options)
-    vmapping, indices, uvs = atlas[0]
-    return {
+    atlas = xatlas.Atlas()
+    if entry is None:
+        atlas.add_mesh(mesh.vertices, mesh.faces)
+        atlas.generate(pack_options=options)
+        vmapping, indices, uvs = atlas[0]
+        entry = {"charts": (vmapping, indices, uvs), "packs": {}}
+    else:
+        # only repack: the islands of a UV mesh are taken as they are as charts
+        charts_vmapping, charts_indices, charts_uvs = entry["charts"]
+        atlas.add_uv_mesh(
+            np.ascontiguousarray(charts_uvs, dtype=np.float32),
+            np.ascontiguousarray(charts_indices, dtype=np.uint32),
+        )
+        atlas.generate(pack_options=options)
+        vmapping, indices, uvs = atlas[0]
+        vmapping = charts_vmapping[vmapping]
+    entry["packs"][texture_resolution, texture_padding] = {
         "vmapping": vmapping,
         "indices": indices,
         "uvs": uvs,
     }
+    _chart_cache[key] = entry
+    while len(_chart_cache) > CHART_CACHE_SIZE:
+        _chart_cache.popitem(last=False)
+    return entry["packs"][texture_resolution, texture_padding]
 
 
-def rasterize_position_atlas(
-    mesh, atlas_vmapping, atlas_indices, atlas_uvs, texture_resolution, texture_padding
+BASIC_VERTEX_SHADER = """
+    #version 330
+    uniform vec2 u_scale;
+    uniform vec2 u_offset;
+    in vec2 in_uv;
+    in vec3 in_pos;
+    out vec3 v_pos;
+    void main() {
+        v_pos = in_pos;
+        gl_Position = vec4((in_uv * u_scale - u_offset) * 2.0 - 1.0, 0.0, 1.0);
+    }
+"""
+
+BASIC_FRAGMENT_SHADER = """
+    #version 330
+    in vec3 v_pos;
+    out vec4 o_col;
+    void main() {
+        o_col = vec4(v_pos, 1.0);
+    }
+"""
+
+GS_VERTEX_SHADER = """
+    #version 330
+    uniform vec2 u_scale;
+    uniform vec2 u_offset;
+    in vec2 in_uv;
+    in vec3 in_pos;
+    out vec3 vg_pos;
+    void main() {
+        vg_pos = in_pos;
+        gl_Position = vec4((in_uv * u_scale - u_offset) * 2.0 - 1.0, 0.0, 1.0);
+    }
+"""
+
+GS_GEOMETRY_SHADER = """
+    #version 330
+    uniform vec2 u_resolution;
+    uniform float u_dilation;
+    layout (triangles) in;
+    layout (triangle_strip, max_vertices = 12) out;
+    in vec3 vg_pos[];
+    out vec3 vf_pos;
+    void lineSegment(int aidx, int bidx) {
+        vec2 a = gl_in[aidx].gl_Position.xy;
+        vec2 b = gl_in[bidx].gl_Position.xy;
+        vec3 aCol = vg_pos[aidx];
+        vec3 bCol = vg_pos[bidx];
+
+        vec2 dir = normalize((b - a) * u_resolution);
+        vec2 offset = vec2(-dir.y, dir.x) * u_dilation / u_resolution;
+
+        gl_Position = vec4(a + offset, 0.0, 1.0);
+        vf_pos = aCol;
+        EmitVertex();
+        gl_Position = vec4(a - offset, 0.0, 1.0);
+        vf_pos = aCol;
+        EmitVertex();
+        gl_Position = vec4(b + offset, 0.0, 1.0);
+        vf_pos = bCol;
+        EmitVertex();
+        gl_Position = vec4(b - offset, 0.0, 1.0);
+        vf_pos = bCol;
+        EmitVertex();
+    }
+    void main() {
+        lineSegment(0, 1);
+        lineSegment(1, 2);
+        lineSegment(2, 0);
+        EndPrimitive();
+    }
+"""
+
+GS_FRAGMENT_SHADER = """
+    #version 330
+    in vec3 vf_pos;
+    out vec4 o_col;
+    void main() {
+        o_col = vec4(vf_pos, 1.0);
+    }
+"""
+
+
+class Baker:
+    """
+    Owns a standalone GL context with the atlas programs compiled and one
+    float framebuffer per texture resolution, so repeated bakes only upload
+    their geometry. Call release() or use it as a context manager to free
+    the GL objects.
+    """
+
+    def __init__(self):
+        if moderngl is None:
+            raise RuntimeError("moderngl is not installed")
+        self.ctx = moderngl.create_context(standalone=True)
+        self.basic_prog = self.ctx.program(
+            vertex_shader=BASIC_VERTEX_SHADER,
+            fragment_shader=BASIC_FRAGMENT_SHADER,
+        )
+        self.gs_prog = self.ctx.program(
+            vertex_shader=GS_VERTEX_SHADER,
+            geometry_shader=GS_GEOMETRY_SHADER,
+            fragment_shader=GS_FRAGMENT_SHADER,
+        )
+        self.fbos = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def framebuffer(self, width, height):
+        if (width, height) not in self.fbos:
+            self.fbos[width, height] = self.ctx.framebuffer(
+                color_attachments=[self.ctx.texture((width, height), 4, dtype="f4")]
+            )
+        return self.fbos[width, height]
+
+    def rasterize_position_tiles(
+        self,
+        mesh,
+        atlas_vmapping,
+        atlas_indices,
+        atlas_uvs,
+        texture_resolution,
+        texture_padding,
+        rows,
+    ):
+        """
+        Yields the (y1 - y0, texture_resolution, 4) band of the position
+        atlas for every (y0, y1) row range in rows, the mesh is uploaded once.
+        """
+        uvs = atlas_uvs.flatten().astype("f4")
+        pos = mesh.vertices[atlas_vmapping].flatten().astype("f4")
+        indices = atlas_indices.flatten().astype("i4")
+        vbo_uvs = self.ctx.buffer(uvs)
+        vbo_pos = self.ctx.buffer(pos)
+        ibo = self.ctx.buffer(indices)
+        vao_content = [
+            vbo_uvs.bind("in_uv", layout="2f"),
+            vbo_pos.bind("in_pos", layout="3f"),
+        ]
+        basic_vao = self.ctx.vertex_array(self.basic_prog, vao_content, ibo)
+        gs_vao = self.ctx.vertex_array(self.gs_prog, vao_content, ibo)
+        try:
+            self.gs_prog["u_dilation"].value = texture_padding
+            for y0, y1 in rows:
+                height = y1 - y0
+                fbo = self.framebuffer(texture_resolution, height)
+                fbo.use()
+                fbo.clear(0.0, 0.0, 0.0, 0.0)
+                # rows y0 to y1 of the atlas fill the viewport
+                for prog in (self.basic_prog, self.gs_prog):
+                    prog["u_scale"].value = (1.0, texture_resolution / height)
+                    prog["u_offset"].value = (0.0, y0 / height)
+                self.gs_prog["u_resolution"].value = (texture_resolution, height)
+                gs_vao.render()
+                basic_vao.render()
+
+                fbo_bytes = fbo.color_attachments[0].read()
+                yield np.frombuffer(fbo_bytes, dtype="f4").reshape(
+                    height, texture_resolution, 4
+                )
+        finally:
+            # per-mesh objects, the programs and framebuffers are kept
+            for obj in (basic_vao, gs_vao, vbo_uvs, vbo_pos, ibo):
+                obj.release()
+
+    def rasterize_position_atlas(
+        self,
+        mesh,
+        atlas_vmapping,
+        atlas_indices,
+        atlas_uvs,
+        texture_resolution,
+        texture_padding,
+    ):
+        (fbo_np,) = self.rasterize_position_tiles(
+            mesh,
+            atlas_vmapping,
+            atlas_indices,
+            atlas_uvs,
+            texture_resolution,
+            texture_padding,
+            [(0, texture_resolution)],
+        )
+        return fbo_np
+
+    def release(self):
+        for fbo in self.fbos.values():
+            for texture in fbo.color_attachments:
+                texture.release()
+            fbo.release()
+        self.fbos = {}
+        self.basic_prog.release()
+        self.gs_prog.release()
+        self.ctx.release()
+
+
+# set once creating a GL context failed, later bakes go to numpy directly
+_gl_unavailable = False
+
+
+def create_baker():
+    """
+    Returns a Baker, or None when moderngl or a GL 3.3 context is not
+    available on this machine.
+    """
+    global _gl_unavailable
+    if _gl_unavailable:
+        return None
+    try:
+        return Baker()
+    except Exception as e:
+        _gl_unavailable = True
+        logging.warning(f"No GL context for texture baking ({e}), using the numpy rasterizer.")
+        return None
+
+
+def dilation_triangles(positions, faces, dilation):
+    """
+    The triangles the geometry shader of the GL path emits: every edge of a
+    face becomes a quad `dilation` pixels wide, the three quads of a face
+    drawn as one strip of 12 vertices, so consecutive quads are joined by
+    two triangles around their shared corner. positions are (N, 2) pixels.
+    Returns (F * 10, 3) triangles indexing (F * 12, 2) positions, and the
+    (F * 12,) original vertex of every position.
+    """
+    n_faces = faces.shape[0]
+    a = faces
+    b = faces[:, [1, 2, 0]]
+    edge = positions[b] - positions[a]  # (F, 3, 2)
+    length = np.linalg.norm(edge, axis=-1, keepdims=True)
+    direction = np.divide(edge, length, out=np.zeros_like(edge), where=length > 0)
+    offset = np.stack([-direction[..., 1], direction[..., 0]], axis=-1) * (dilation / 2.0)
+    strip_vertices = np.stack([a, a, b, b], axis=-1).reshape(n_faces, 12)
+    strip_positions = np.stack(
+        [
+            positions[a] + offset,
+            positions[a] - offset,
+            positions[b] + offset,
+            positions[b] - offset,
+        ],
+        axis=2,
+    ).reshape(n_faces, 12, 2)
+    # triangle k of the strip is (k, k + 1, k + 2)
+    k = np.arange(10)
+    strip = np.stack([k, k + 1, k + 2], axis=-1)
+    triangles = (np.arange(n_faces)[:, None, None] * 12 + strip).reshape(-1, 3)
+    return triangles, strip_positions.reshape(-1, 2), strip_vertices.reshape(-1)
+
+
+def rasterize_position_tiles_numpy(
+    mesh,
+    atlas_vmapping,
+    atlas_indices,
+    atlas_uvs,
+    texture_resolution,
+    texture_padding,
+    rows,
 ):
-    ctx = moderngl.create_context(standalone=True)
-    basic_prog = ctx.program(
-        vertex_shader="""
-            #version 330
-            in vec2 in_uv;
-            in vec3 in_pos;
-            out vec3 v_pos;
-            void main() {
-                v_pos = in_pos;
-                gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
-            }
-        """,
-        fragment_shader="""
-            #version 330
-            in vec3 v_pos;
-            out vec4 o_col;
-            void main() {
-                o_col = vec4(v_pos, 1.0);
-            }
-        """,
+    """
+    CPU version of Baker.rasterize_position_tiles with the same output: the
+    dilated edges are drawn first, then the faces, the last primitive
+    written to a texel wins, like the GL passes without depth test.
+    """
+    pos = np.asarray(mesh.vertices, dtype=np.float32)[atlas_vmapping]
+    attributes = np.concatenate([pos, np.ones((pos.shape[0], 1), np.float32)], axis=1)
+    faces = np.asarray(atlas_indices, dtype=np.int64).reshape(-1, 3)
+    # uv (0, 0) is the corner of the first texel, rows are read bottom up
+    positions = np.asarray(atlas_uvs, dtype=np.float64) * texture_resolution
+
+    dilated, dilated_positions, dilated_vertices = dilation_triangles(
+        positions, faces, texture_padding
     )
-    gs_prog = ctx.program(
-        vertex_shader="""
-            #version 330
-            in vec2 in_uv;
-            in vec3 in_pos;
-            out vec3 vg_pos;
-            void main() {
-                vg_pos = in_pos;
-                gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
-            }
-        """,
-        geometry_shader="""
-            #version 330
-            uniform float u_resolution;
-            uniform float u_dilation;
-            layout (triangles) in;
-            layout (triangle_strip, max_vertices = 12) out;
-            in vec3 vg_pos[];
-            out vec3 vf_pos;
-            void lineSegment(int aidx, int bidx) {
-                vec2 a = gl_in[aidx].gl_Position.xy;
-                vec2 b = gl_in[bidx].gl_Position.xy;
-                vec3 aCol = vg_pos[aidx];
-                vec3 bCol = vg_pos[bidx];
-
-                vec2 dir = normalize((b - a) * u_resolution);
-                vec2 offset = vec2(-dir.y, dir.x) * u_dilation / u_resolution;
-
-                gl_Position = vec4(a + offset, 0.0, 1.0);
-                vf_pos = aCol;
-                EmitVertex();
-                gl_Position = vec4(a - offset, 0.0, 1.0);
-                vf_pos = aCol;
-                EmitVertex();
-                gl_Position = vec4(b + offset, 0.0, 1.0);
-                vf_pos = bCol;
-                EmitVertex();
-                gl_Position = vec4(b - offset, 0.0, 1.0);
-                vf_pos = bCol;
-                EmitVertex();
-            }
-            void main() {
-                lineSegment(0, 1);
-                lineSegment(1, 2);
-                lineSegment(2, 0);
-                EndPrimitive();
-            }
-        """,
-        fragment_shader="""
-            #version 330
-            in vec3 vf_pos;
-            out vec4 o_col;
-            void main() {
-                o_col = vec4(vf_pos, 1.0);
-            }
-        """,
+    positions = np.concatenate([dilated_positions, positions])
+    faces = np.concatenate([dilated, faces + dilated_positions.shape[0]])
+    attributes = np.concatenate([attributes[dilated_vertices], attributes])
+    for y0, y1 in rows:
+        tile, _ = rasterize(
+            positions - np.array([0.0, y0]),
+            faces,
+            attributes,
+            y1 - y0,
+            texture_resolution,
+        )
+        yield tile
+
+
+def rasterize_position_atlas_numpy(
+    mesh,
+    atlas_vmapping,
+    atlas_indices,
+    atlas_uvs,
+    texture_resolution,
+    texture_padding,
+):
+    (image,) = rasterize_position_tiles_numpy(
+        mesh,
+        atlas_vmapping,
+        atlas_indices,
+        atlas_uvs,
+        texture_resolution,
+        texture_padding,
+        [(0, texture_resolution)],
     )
-    uvs = atlas_uvs.flatten().astype("f4")
-    pos = mesh.vertices[atlas_vmapping].flatten().astype("f4")
-    indices = atlas_indices.flatten().astype("i4")
-    vbo_uvs = ctx.buffer(uvs)
-    vbo_pos = ctx.buffer(pos)
-    ibo = ctx.buffer(indices)
-    vao_content = [
-        vbo_uvs.bind("in_uv", layout="2f"),
-        vbo_pos.bind("in_pos", layout="3f"),
-    ]
-    basic_vao = ctx.vertex_array(basic_prog, vao_content, ibo)
-    gs_vao = ctx.vertex_array(gs_prog, vao_content, ibo)
-    fbo = ctx.framebuffer(
-        color_attachments=[
-            ctx.texture((texture_resolution, texture_resolution), 4, dtype="f4")
-        ]
+    return image
+
+
+def rasterize_position_tiles(
+    mesh,
+    atlas_vmapping,
+    atlas_indices,
+    atlas_uvs,
+    texture_resolution,
+    texture_padding,
+    rows,
+    baker=None,
+):
+    args = (
+        mesh,
+        atlas_vmapping,
+        atlas_indices,
+        atlas_uvs,
+        texture_resolution,
+        texture_padding,
+        rows,
     )
-    fbo.use()
-    fbo.clear(0.0, 0.0, 0.0, 0.0)
-    gs_prog["u_resolution"].value = texture_resolution
-    gs_prog["u_dilation"].value = texture_padding
-    gs_vao.render()
-    basic_vao.render()
-
-    fbo_bytes = fbo.color_attachments[0].read()
-    fbo_np = np.frombuffer(fbo_bytes, dtype="f4").reshape(
-        texture_resolution, texture_resolution, 4
+    if baker is not None:
+        yield from baker.rasterize_position_tiles(*args)
+        return
+    # without a baker, a temporary one is set up and released for this mesh
+    baker = create_baker()
+    if baker is None:
+        yield from rasterize_position_tiles_numpy(*args)
+        return
+    with baker:
+        yield from baker.rasterize_position_tiles(*args)
+
+
+def rasterize_position_atlas(
+    mesh,
+    atlas_vmapping,
+    atlas_indices,
+    atlas_uvs,
+    texture_resolution,
+    texture_padding,
+    baker=None,
+):
+    (fbo_np,) = rasterize_position_tiles(
+        mesh,
+        atlas_vmapping,
+        atlas_indices,
+        atlas_uvs,
+        texture_resolution,
+        texture_padding,
+        [(0, texture_resolution)],
+        baker,
     )
     return fbo_np
 
 
-def positions_to_colors(model, scene_code, positions_texture, texture_resolution):
-    positions = torch.tensor(positions_texture.reshape(-1, 4)[:, :-1])
+def positions_to_colors(
+    model, scene_code, positions_texture, texture_resolution, chunk_size=1 << 18
+):
+    """
+    Queries the scene colors of the covered texels only, chunk_size texels
+    at a time, and scatters them into an (H, W, 4) uint8 RGBA texture. Texels
+    no triangle covers stay transparent black. positions_texture can be a
+    band of rows of the atlas.
+    """
+    positions_flat = positions_texture.reshape(-1, 4)
+    covered = np.flatnonzero(positions_flat[:, -1] != 0.0)
+    colors = np.zeros((positions_flat.shape[0], 4), dtype=np.uint8)
+    colors[covered, 3] = 255
     with torch.no_grad():
-        queried_grid = model.renderer.query_triplane(
-            model.decoder,
-            positions,
-            scene_code,
-        )
-    rgb_f = queried_grid["color"].numpy().reshape(-1, 3)
-    rgba_f = np.insert(rgb_f, 3, positions_texture.reshape(-1, 4)[:, -1], axis=1)
-    rgba_f[rgba_f[:, -1] == 0.0] = [0, 0, 0, 0]
-    return rgba_f.reshape(texture_resolution, texture_resolution, 4)
+        for i in range(0, covered.shape[0], chunk_size):
+            texels = covered[i : i + chunk_size]
+            queried = model.renderer.query_triplane(
+                model.decoder,
+                torch.from_numpy(positions_flat[texels, :3]).to(scene_code.device),
+                scene_code,
+            )
+            colors[texels, :3] = (queried["color"].cpu().numpy() * 255.0).astype(np.uint8)
+    return colors.reshape(positions_texture.shape[:-1] + (4,))
 
 
-def bake_texture(mesh, model, scene_code, texture_resolution):
+def bake_texture(mesh, model, scene_code, texture_resolution, baker=None):
     texture_padding = round(max(2, texture_resolution / 256))
     atlas = make_atlas(mesh, texture_resolution, texture_padding)
     positions_texture = rasterize_position_atlas(
@@ -158,6 +468,7 @@ def bake_texture(mesh, model, scene_code, texture_resolution):
         atlas["uvs"],
         texture_resolution,
         texture_padding,
+        baker,
     )
     colors_texture = positions_to_colors(
         model, scene_code, positions_texture, texture_resolution
@@ -168,3 +479,47 @@ def bake_texture(mesh, model, scene_code, texture_resolution):
         "uvs": atlas["uvs"],
         "colors": colors_texture,
     }
+
+
+def bake_texture_tiled(
+    mesh,
+    model,
+    scene_code,
+    texture_resolution,
+    texture_path,
+    tile_size=1024,
+    baker=None,
+):
+    """
+    Like bake_texture, but rasterizes and colors the atlas tile_size rows at
+    a time and streams every band to the PNG at texture_path, so memory
+    stays bounded by one band whatever the resolution. Returns the atlas
+    without "colors".
+    """
+    texture_padding = round(max(2, texture_resolution / 256))
+    atlas = make_atlas(mesh, texture_resolution, texture_padding)
+    # the texture is saved flipped, its first rows are the last atlas rows
+    rows = [
+        (max(y1 - tile_size, 0), y1)
+        for y1 in range(texture_resolution, 0, -tile_size)
+    ]
+    with PNGWriter(texture_path, texture_resolution, texture_resolution) as writer:
+        for positions_tile in rasterize_position_tiles(
+            mesh,
+            atlas["vmapping"],
+            atlas["indices"],
+            atlas["uvs"],
+            texture_resolution,
+            texture_padding,
+            rows,
+            baker,
+        ):
+            colors_tile = positions_to_colors(
+                model, scene_code, positions_tile, texture_resolution
+            )
+            writer.write(colors_tile[::-1])
+    return {
+        "vmapping": atlas["vmapping"],
+        "indices": atlas["indices"],
+        "uvs": atlas["uvs"],
+    }
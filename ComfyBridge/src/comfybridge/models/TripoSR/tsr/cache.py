@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+from .utils import get_spherical_cameras, rays_intersect_bbox
+
+
+class SceneCodeCache:
+    """
+    On-disk cache of scene codes, keyed by a hash of the preprocessed
+    conditioning image and the model identity. Entries are plain .npy files
+    that are memory-mapped on load; once the directory grows past max_bytes
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, rgb_cond: torch.Tensor, model_id: str) -> str:
+        rgb_cond = rgb_cond.detach().cpu().contiguous()
+        h = hashlib.sha1()
+        h.update(model_id.encode("utf-8"))
+        h.update(str((tuple(rgb_cond.shape), str(rgb_cond.dtype))).encode("utf-8"))
+        h.update(rgb_cond.numpy().tobytes())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            # copy-on-write mapping: no read, no copy until the tensor is used
+            scene_code = np.load(path, mmap_mode="c")
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return torch.from_numpy(scene_code)
+
+    def put(self, key: str, scene_code: torch.Tensor) -> None:
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, scene_code.detach().cpu().numpy())
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # still mapped by another process (Windows), try the next one
+                continue
+            total -= size
+
+
+class RayBundleCache:
+    """
+    Camera rays of a turntable rig together with their bounding box
+    intersections, keyed by the rig parameters and the box radius. Bundles
+    are kept in memory for the life of the process and, with a cache_dir,
+    persisted as .npy files next to a cameras.json describing the rig.
+    """
+
+    NAMES = ("rays_o", "rays_d", "t_near", "t_far", "rays_valid")
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self.bundles: Dict[str, Dict[str, torch.Tensor]] = {}
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def rig(
+        n_views: int,
+        elevation_deg: float,
+        camera_distance: float,
+        fovy_deg: float,
+        height: int,
+        width: int,
+        radius: float,
+    ) -> dict:
+        return {
+            "n_views": int(n_views),
+            "elevation_deg": float(elevation_deg),
+            "camera_distance": float(camera_distance),
+            "fovy_deg": float(fovy_deg),
+            "height": int(height),
+            "width": int(width),
+            "radius": float(radius),
+        }
+
+    def key(self, rig: dict) -> str:
+        return hashlib.sha1(json.dumps(rig, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, device=None, **rig_kwargs) -> Dict[str, torch.Tensor]:
+        rig = self.rig(**rig_kwargs)
+        key = self.key(rig)
+        bundle = self.bundles.get(key)
+        if bundle is None:
+            bundle = self._load(key, rig)
+        if bundle is None:
+            bundle = self._compute(rig)
+            self._save(key, rig, bundle)
+        self.bundles[key] = bundle
+        return {k: v.to(device) for k, v in bundle.items()}
+
+    def _compute(self, rig: dict) -> Dict[str, torch.Tensor]:
+        rays_o, rays_d = get_spherical_cameras(
+            rig["n_views"],
+            rig["elevation_deg"],
+            rig["camera_distance"],
+            rig["fovy_deg"],
+            rig["height"],
+            rig["width"],
+        )
+        rays_o, rays_d = rays_o.contiguous(), rays_d.contiguous()
+        t_near, t_far, rays_valid = rays_intersect_bbox(rays_o, rays_d, rig["radius"])
+        return {
+            "rays_o": rays_o,
+            "rays_d": rays_d,
+            "t_near": t_near,
+            "t_far": t_far,
+            "rays_valid": rays_valid,
+        }
+
+    def _dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _load(self, key: str, rig: dict) -> Optional[Dict[str, torch.Tensor]]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(os.path.join(self._dir(key), "cameras.json"), "r") as f:
+                if json.load(f).get("rig") != rig:
+                    return None
+            return {
+                name: torch.from_numpy(
+                    np.load(os.path.join(self._dir(key), f"{name}.npy"))
+                )
+                for name in self.NAMES
+            }
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, key: str, rig: dict, bundle: Dict[str, torch.Tensor]) -> None:
+        if self.cache_dir is None:
+            return
+        bundle_dir = self._dir(key)
+        os.makedirs(bundle_dir, exist_ok=True)
+        for name in self.NAMES:
+            tmp_path = os.path.join(bundle_dir, f"{name}.npy.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, bundle[name].numpy())
+            os.replace(tmp_path, os.path.join(bundle_dir, f"{name}.npy"))
+        # written last, a bundle without it is incomplete and gets recomputed
+        with open(os.path.join(bundle_dir, "cameras.json"), "w") as f:
+            json.dump({"rig": rig}, f, indent=2)
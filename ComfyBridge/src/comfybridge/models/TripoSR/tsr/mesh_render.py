@@ -0,0 +1,48 @@
+import numpy as np
+import trimesh
+
+from .rasterize import rasterize
+from .utils import get_spherical_camera_poses
+
+
+def render_mesh(
+    mesh: trimesh.Trimesh,
+    vertex_colors: np.ndarray,
+    n_views: int,
+    elevation_deg: float = 0.0,
+    camera_distance: float = 1.9,
+    fovy_deg: float = 40.0,
+    height: int = 256,
+    width: int = 256,
+) -> np.ndarray:
+    """
+    Rasterises an extracted mesh from the turntable cameras TSR.render uses,
+    on a white background like the NeRF frames. vertex_colors are (N, 3) in
+    [0, 1]. Returns (n_views, height, width, 3) float32 images.
+    """
+    # extract_mesh stores vertices with x and z swapped, back to the scene axes
+    vertices = np.asarray(mesh.vertices, dtype=np.float64)[:, [2, 1, 0]]
+    faces = np.asarray(mesh.faces)
+
+    c2w, focal_length = get_spherical_camera_poses(
+        n_views, elevation_deg, camera_distance, fovy_deg, height
+    )
+    c2w, focal_length = c2w.numpy().astype(np.float64), focal_length.numpy()
+
+    images = np.ones((n_views, height, width, 3), dtype=np.float32)
+    for i in range(n_views):
+        # world to camera, the camera looks down its -z axis
+        cam = (vertices - c2w[i, :3, 3]) @ c2w[i, :3, :3]
+        depth = -cam[:, 2]
+        positions = np.stack(
+            [
+                width / 2.0 + focal_length[i] * cam[:, 0] / depth,
+                height / 2.0 - focal_length[i] * cam[:, 1] / depth,
+            ],
+            axis=-1,
+        )
+        # every turntable camera sits outside the mesh, no clipping needed
+        rasterize(
+            positions, faces, vertex_colors, height, width, depth=depth, out=images[i]
+        )
+    return images
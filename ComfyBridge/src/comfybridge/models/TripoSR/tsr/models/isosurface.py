@@ -1,11 +1,91 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
 from typing import Callable, Optional, Tuple
 
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import mcubes   # ← using PyMCubes instead of torchmcubes
 
 
+def _plane_keys(v_pos_np, plane):
+    # indices of the vertices lying on the first-axis plane, and their
+    # remaining two coordinates quantised to 1e-6 of a cell
+    on_plane = np.flatnonzero(np.abs(v_pos_np[:, 0] - plane) < 1e-6)
+    keys = np.round(v_pos_np[on_plane, 1:] * 1e6).astype(np.int64)
+    return on_plane, [tuple(key) for key in keys]
+
+
+def merge_partial_meshes(parts, starts):
+    """
+    Concatenates (vertices, triangles) pieces given in the same grid index
+    space, ordered along the first axis with piece i starting on the plane
+    starts[i], and welds the vertices consecutive pieces share on that plane.
+    Those are interpolated from the same two samples in both pieces, only
+    the rounding may differ, so they are matched on a 1e-6 cell quantum.
+    Every other vertex is kept, in the order of its piece.
+    """
+    v_list, t_list = [], []
+    offset = 0
+    shared = {}  # key on the next piece's start plane -> merged vertex index
+    for i, (v_pos_np, t_pos_idx_np) in enumerate(parts):
+        index = np.full(v_pos_np.shape[0], -1, dtype=np.int64)
+        if i > 0:
+            on_plane, keys = _plane_keys(v_pos_np, starts[i])
+            for vertex, key in zip(on_plane, keys):
+                index[vertex] = shared.get(key, -1)
+        keep = index < 0
+        index[keep] = offset + np.arange(np.count_nonzero(keep))
+        offset += np.count_nonzero(keep)
+        v_list.append(v_pos_np[keep])
+        t_list.append(index[t_pos_idx_np.astype(np.int64)])
+        if i + 1 < len(parts):
+            on_plane, keys = _plane_keys(v_pos_np, starts[i + 1])
+            shared = dict(zip(keys, index[on_plane]))
+    if offset == 0:
+        return np.zeros((0, 3), dtype=np.float64), np.zeros((0, 3), dtype=np.int64)
+    return np.concatenate(v_list, axis=0), np.concatenate(t_list, axis=0)
+
+
+def _marching_cubes_block(volume_np, offset):
+    # runs in a worker process, PyMCubes holds the GIL
+    v_pos_np, t_pos_idx_np = mcubes.marching_cubes(volume_np, 0.0)
+    v_pos_np[:, 0] += offset
+    return v_pos_np, t_pos_idx_np
+
+
+# kept alive between extractions, spawning workers costs more than a block
+_block_pool = None
+
+
+def _get_block_pool(num_workers: int) -> ProcessPoolExecutor:
+    global _block_pool
+    if _block_pool is None or _block_pool[0] != num_workers:
+        if _block_pool is not None:
+            _block_pool[1].shutdown()
+        _block_pool = (num_workers, ProcessPoolExecutor(max_workers=num_workers))
+    return _block_pool[1]
+
+
+def marching_cubes_blocks(volume_np, num_workers: int):
+    """
+    Polygonises the volume in blocks along its first axis on a process pool.
+    Blocks overlap by one plane of samples and the partial meshes are welded,
+    which gives the same triangles as a single marching cubes call.
+    """
+    n_cells = volume_np.shape[0] - 1
+    n_blocks = min(n_cells, 2 * num_workers)  # a few extra blocks to even out load
+    bounds = np.linspace(0, n_cells, n_blocks + 1).round().astype(int)
+    pool = _get_block_pool(num_workers)
+    futures = [
+        pool.submit(_marching_cubes_block, volume_np[start : stop + 1], start)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    parts = [future.result() for future in futures]
+    return merge_partial_meshes(parts, bounds[:-1])
+
+
 class IsosurfaceHelper(nn.Module):
     points_range: Tuple[float, float] = (0, 1)
 
@@ -35,9 +115,170 @@ class MarchingCubeHelper(IsosurfaceHelper):
             self._grid_vertices = verts
         return self._grid_vertices
 
+    def adaptive_level(
+        self,
+        query_level: Callable[[torch.FloatTensor], torch.FloatTensor],
+        base_cells: int = 32,
+        device=None,
+    ) -> torch.FloatTensor:
+        """
+        Coarse-to-fine evaluation of the level grid. query_level maps (N, 3)
+        points in points_range to their level. The grid is first sampled with
+        about base_cells cells per axis; at each finer spacing only the points of
+        cells whose corners disagree in sign (plus a one-cell margin) are queried,
+        the rest are trilinearly filled from the coarser grid, which keeps their
+        sign. Every cell the surface crosses ends up fully queried, so marching
+        cubes matches the dense grid wherever the coarse grid resolves the shape.
+        Returns the same (resolution**3, 1) level as a dense query.
+        """
+        n_cells = self.resolution - 1
+        step = 1
+        while math.ceil(n_cells / (step * 2)) >= base_cells:
+            step *= 2
+
+        lo, hi = self.points_range
+
+        def query(indices: torch.LongTensor) -> torch.FloatTensor:
+            points = indices.float() / n_cells * (hi - lo) + lo
+            return query_level(points).reshape(-1).float()
+
+        # pad the grid to a multiple of the coarsest step, cropped at the end
+        m = math.ceil(n_cells / step) + 1
+        axis = torch.arange(m, device=device) * step
+        indices = torch.stack(torch.meshgrid(axis, axis, axis, indexing="ij"), dim=-1)
+        level = query(indices.reshape(-1, 3)).view(m, m, m)
+
+        while step > 1:
+            inside = level > 0
+            corners = torch.stack(
+                [
+                    inside[dx : dx + m - 1, dy : dy + m - 1, dz : dz + m - 1]
+                    for dx in (0, 1)
+                    for dy in (0, 1)
+                    for dz in (0, 1)
+                ],
+                dim=0,
+            )
+            active = corners.any(dim=0) & ~corners.all(dim=0)
+            # margin for thin features slipping between coarse samples
+            active = (
+                F.max_pool3d(active[None, None].float(), 3, stride=1, padding=1)[0, 0]
+                > 0
+            )
+
+            fine_m = 2 * (m - 1) + 1
+            fine_level = F.interpolate(
+                level[None, None],
+                size=(fine_m, fine_m, fine_m),
+                mode="trilinear",
+                align_corners=True,
+            )[0, 0]
+            refine = torch.zeros(
+                (fine_m, fine_m, fine_m), dtype=torch.bool, device=level.device
+            )
+            for dx in range(3):
+                for dy in range(3):
+                    for dz in range(3):
+                        refine[
+                            dx : dx + 2 * (m - 1) : 2,
+                            dy : dy + 2 * (m - 1) : 2,
+                            dz : dz + 2 * (m - 1) : 2,
+                        ] |= active
+            refine[::2, ::2, ::2] = False  # already queried
+
+            step //= 2
+            refine_indices = refine.nonzero()
+            if refine_indices.shape[0] > 0:
+                fine_level[refine] = query(refine_indices * step)
+            fine_level[::2, ::2, ::2] = level
+            level, m = fine_level, fine_m
+
+        res = self.resolution
+        return level[:res, :res, :res].reshape(-1, 1)
+
+    def interpolate(
+        self, values: torch.Tensor, points: torch.FloatTensor
+    ) -> torch.FloatTensor:
+        """
+        Trilinear lookup of per grid vertex values, shaped (res, res, res, C)
+        and of any dtype, at (N, 3) points in points_range. Only the eight
+        corners of each point are converted to float.
+        """
+        res = self.resolution
+        lo, hi = self.points_range
+        x = ((points - lo) / (hi - lo) * (res - 1)).clamp(0, res - 1)
+        x0 = x.floor().long().clamp(max=res - 2)
+        w = x - x0
+        out = 0.0
+        for dx in (0, 1):
+            for dy in (0, 1):
+                for dz in (0, 1):
+                    weight = (
+                        (w[:, 0] if dx else 1 - w[:, 0])
+                        * (w[:, 1] if dy else 1 - w[:, 1])
+                        * (w[:, 2] if dz else 1 - w[:, 2])
+                    )
+                    corner = values[x0[:, 0] + dx, x0[:, 1] + dy, x0[:, 2] + dz]
+                    out = out + corner.float() * weight[:, None]
+        return out
+
+    def grid_slab(self, start: int, stop: int, device=None) -> torch.FloatTensor:
+        # rows [start, stop) of grid_vertices along the first axis, built on the fly
+        axis = torch.linspace(*self.points_range, self.resolution, device=device)
+        x, y, z = torch.meshgrid(axis[start:stop], axis, axis, indexing="ij")
+        return torch.stack([x, y, z], dim=-1).reshape(-1, 3)
+
+    def stream(
+        self,
+        query_level: Callable[[torch.FloatTensor], torch.FloatTensor],
+        slab_size: int = 16,
+        device=None,
+    ) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Slab-wise extraction along the first grid axis: grid points are built,
+        queried and polygonised one slab at a time. Consecutive slabs share one
+        plane of samples, queried once, and the vertices on it are welded, so
+        the mesh is the same as forward() on the full grid while memory scales
+        with resolution**2 * slab_size.
+        """
+        res = self.resolution
+        parts, starts = [], []
+        shared_plane = None
+        for start in range(0, res - 1, slab_size):
+            stop = min(start + slab_size, res - 1) + 1
+            query_start = start if shared_plane is None else start + 1
+            level = query_level(self.grid_slab(query_start, stop, device)).view(
+                stop - query_start, res, res
+            )
+            if shared_plane is not None:
+                level = torch.cat([shared_plane[None], level], dim=0)
+            shared_plane = level[-1]
+
+            v_pos_np, t_pos_idx_np = mcubes.marching_cubes(
+                -level.detach().cpu().numpy(), 0.0
+            )
+            v_pos_np[:, 0] += start
+            parts.append((v_pos_np, t_pos_idx_np))
+            starts.append(start)
+
+        v_pos_np, t_pos_idx_np = merge_partial_meshes(parts, starts)
+        return self._to_tensors(v_pos_np, t_pos_idx_np, device)
+
+    def _to_tensors(self, v_pos_np, t_pos_idx_np, device):
+        # reorder vertices (TripoSR-specific convention)
+        v_pos_np = v_pos_np[:, [2, 1, 0]]
+        v_pos_np = v_pos_np / (self.resolution - 1.0)
+
+        # convert back to PyTorch
+        v_pos = torch.from_numpy(v_pos_np).float()
+        t_pos_idx = torch.from_numpy(t_pos_idx_np.astype(np.int32))
+
+        return v_pos.to(device), t_pos_idx.to(device)
+
     def forward(
         self,
         level: torch.FloatTensor,
+        num_workers: int = 0,
     ) -> Tuple[torch.FloatTensor, torch.LongTensor]:
 
         # level shape: (res, res, res)
@@ -48,14 +289,9 @@ class MarchingCubeHelper(IsosurfaceHelper):
 
         # run marching cubes
         # PyMCubes returns (vertices, triangles), both numpy arrays
-        v_pos_np, t_pos_idx_np = mcubes.marching_cubes(vol_np, 0.0)
-
-        # reorder vertices (TripoSR-specific convention)
-        v_pos_np = v_pos_np[:, [2, 1, 0]]
-        v_pos_np = v_pos_np / (self.resolution - 1.0)
-
-        # convert back to PyTorch
-        v_pos = torch.from_numpy(v_pos_np).float()
-        t_pos_idx = torch.from_numpy(t_pos_idx_np.astype(np.int32))
+        if num_workers > 1:
+            v_pos_np, t_pos_idx_np = marching_cubes_blocks(vol_np, num_workers)
+        else:
+            v_pos_np, t_pos_idx_np = mcubes.marching_cubes(vol_np, 0.0)
 
-        return v_pos.to(level.device), t_pos_idx.to(level.device)
+        return self._to_tensors(v_pos_np, t_pos_idx_np, level.device)
@@ -1,7 +1,9 @@
+import time
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, List, Optional
 
 import torch
+import torch.nn as nn
 import torch.nn.functional as F
 from einops import rearrange, reduce
 
@@ -31,6 +33,13 @@ class TriplaneNeRFRenderer(BaseModule):
     def configure(self) -> None:
         assert self.cfg.feature_reduction in ["concat", "mean"]
         self.chunk_size = 0
+        self.num_workers = 0
+        self.occupancy_resolution = 0
+        self.occupancy_threshold = 0.01
+        self.termination_threshold = 0.0
+        self.termination_block_size = 16
+        self.num_coarse_samples = 0
+        self.num_fine_samples = 0
 
     def set_chunk_size(self, chunk_size: int):
         assert (
@@ -38,6 +47,128 @@ class TriplaneNeRFRenderer(BaseModule):
         ), "chunk_size must be a non-negative integer (0 for no chunking)."
         self.chunk_size = chunk_size
 
+    def set_num_workers(self, num_workers: int):
+        # threads running query chunks in parallel on CPU, 0 or 1 for serial
+        assert num_workers >= 0, "num_workers must be a non-negative integer."
+        self.num_workers = num_workers
+
+    def estimate_point_bytes(self, decoder: torch.nn.Module) -> int:
+        """
+        Rough peak memory of one point in query_triplane: its position and
+        plane coordinates, the sampled features (twice, grid_sample output
+        and the rearranged copy), the two widest MLP activations alive at a
+        time and the decoder outputs with their activations.
+        """
+        linears = [m for m in decoder.modules() if isinstance(m, nn.Linear)]
+        in_features = linears[0].in_features
+        widest = max(m.out_features for m in linears)
+        n_outputs = 2 * linears[-1].out_features
+        n_floats = 3 + 3 * 2 + 2 * in_features + 2 * widest + n_outputs
+        return 4 * n_floats
+
+    def auto_chunk_size(self, decoder: torch.nn.Module, budget_bytes: int) -> int:
+        # largest power of two whose working set fits the budget, with 2x headroom
+        chunk_size = max(1, budget_bytes // (2 * self.estimate_point_bytes(decoder)))
+        return 1 << (chunk_size.bit_length() - 1)
+
+    def benchmark_chunk_size(
+        self,
+        decoder: torch.nn.Module,
+        candidates: List[int],
+        device=None,
+        n_points: int = 1 << 18,
+        plane_size: int = 64,
+    ) -> int:
+        """
+        Times query_triplane on the same random points with each candidate
+        chunk size and returns the smallest one within 5% of the best
+        throughput. Restores the current chunk size.
+        """
+        in_features = next(
+            m.in_features for m in decoder.modules() if isinstance(m, nn.Linear)
+        )
+        n_channels = (
+            in_features // 3 if self.cfg.feature_reduction == "concat" else in_features
+        )
+        triplane = torch.randn(3, n_channels, plane_size, plane_size, device=device)
+        positions = (torch.rand(n_points, 3, device=device) * 2 - 1) * self.cfg.radius
+
+        def sync():
+            if positions.is_cuda:
+                torch.cuda.synchronize(positions.device)
+
+        chunk_size = self.chunk_size
+        timings = {}
+        try:
+            with torch.no_grad():
+                for candidate in sorted(candidates):
+                    self.set_chunk_size(candidate)
+                    self.query_triplane(decoder, positions[:candidate], triplane)  # warm-up
+                    sync()
+                    t0 = time.perf_counter()
+                    self.query_triplane(decoder, positions, triplane)
+                    sync()
+                    timings[candidate] = time.perf_counter() - t0
+        finally:
+            self.set_chunk_size(chunk_size)
+
+        best = min(timings.values())
+        return min(c for c, t in timings.items() if t <= best * 1.05)
+
+    def set_occupancy_grid(self, resolution: int, threshold: float = 0.01):
+        assert (
+            resolution >= 0
+        ), "resolution must be a non-negative integer (0 to disable the occupancy grid)."
+        self.occupancy_resolution = resolution
+        self.occupancy_threshold = threshold
+
+    def set_early_termination(self, threshold: float, block_size: int = 16):
+        # rays stop being sampled once their transmittance drops below threshold,
+        # 0 composites every sample at once. Not used with importance sampling
+        assert threshold >= 0, "threshold must be non-negative (0 to disable)."
+        assert block_size > 0, "block_size must be a positive integer."
+        self.termination_threshold = threshold
+        self.termination_block_size = block_size
+
+    def set_importance_sampling(self, num_coarse_samples: int, num_fine_samples: int):
+        # coarse/fine sampling instead of num_samples_per_ray uniform samples,
+        # 0 coarse samples to disable
+        assert (
+            num_coarse_samples >= 0 and num_fine_samples >= 0
+        ), "sample counts must be non-negative integers."
+        self.num_coarse_samples = num_coarse_samples
+        self.num_fine_samples = num_fine_samples
+
+    def build_occupancy_grid(
+        self, decoder: torch.nn.Module, triplane: torch.Tensor
+    ) -> Optional[torch.Tensor]:
+        """
+        Boolean (R, R, R) grid over the bounding box, True for cells that may
+        hold density above occupancy_threshold. Built from one query of the
+        cell corners: a cell is occupied if any corner is, and the result is
+        dilated by one cell so thin features between corners are kept.
+        Returns None when the occupancy grid is disabled.
+        """
+        res = self.occupancy_resolution
+        if res <= 0:
+            return None
+        axis = torch.linspace(
+            -self.cfg.radius, self.cfg.radius, res + 1, device=triplane.device
+        )
+        corners = torch.stack(torch.meshgrid(axis, axis, axis, indexing="ij"), dim=-1)
+        density = self.query_triplane(decoder, corners, triplane)["density_act"]
+        occupied = (density[..., 0] > self.occupancy_threshold).float()
+        occupied = F.max_pool3d(occupied[None, None], 2, stride=1)
+        occupied = F.max_pool3d(occupied, 3, stride=1, padding=1)
+        return occupied[0, 0] > 0
+
+    def _occupied(self, occupancy_grid: torch.Tensor, positions: torch.Tensor):
+        # nearest cell lookup of positions in (-radius, radius)
+        res = occupancy_grid.shape[0]
+        idx = scale_tensor(positions, (-self.cfg.radius, self.cfg.radius), (0, res))
+        idx = idx.long().clamp(0, res - 1)
+        return occupancy_grid[idx[..., 0], idx[..., 1], idx[..., 2]]
+
     
 
     def query_triplane(
@@ -74,74 +205,275 @@ class TriplaneNeRFRenderer(BaseModule):
                 raise NotImplementedError
 
             net_out: Dict[str, torch.Tensor] = decoder(out)
+            # activations per chunk, so chunk_batch fills every output in place
+            net_out["density_act"] = get_activation(self.cfg.density_activation)(
+                net_out["density"] + self.cfg.density_bias
+            )
+            net_out["color"] = get_activation(self.cfg.color_activation)(
+                net_out["features"]
+            )
             return net_out
 
         if self.chunk_size > 0:
-            net_out = chunk_batch(_query_chunk, self.chunk_size, positions)
+            net_out = chunk_batch(
+                _query_chunk,
+                self.chunk_size,
+                positions,
+                num_workers=self.num_workers if positions.device.type == "cpu" else 0,
+            )
         else:
             net_out = _query_chunk(positions)
 
-        net_out["density_act"] = get_activation(self.cfg.density_activation)(
-            net_out["density"] + self.cfg.density_bias
-        )
-        net_out["color"] = get_activation(self.cfg.color_activation)(
-            net_out["features"]
-        )
-
         net_out = {k: v.view(*input_shape, -1) for k, v in net_out.items()}
 
         return net_out
   
 
 
+    eps = 1e-10
+
+    def _query_samples(
+        self,
+        decoder: torch.nn.Module,
+        triplane: torch.Tensor,
+        xyz: torch.Tensor,
+        occupancy_grid: Optional[torch.Tensor] = None,
+    ):
+        # density_act and color of ray samples shaped (..., 3)
+        if occupancy_grid is None:
+            mlp_out = self.query_triplane(
+                decoder=decoder,
+                positions=xyz,
+                triplane=triplane,
+            )
+            return mlp_out["density_act"], mlp_out["color"]
+
+        # only samples in occupied cells go through the decoder,
+        # the others are empty space and contribute nothing
+        occupied = self._occupied(occupancy_grid, xyz)
+        density_act = xyz.new_zeros((*occupied.shape, 1))
+        color = xyz.new_zeros((*occupied.shape, 3))
+        if not occupied.any():
+            # e.g. the back samples of rays that missed the object
+            return density_act, color
+        mlp_out = self.query_triplane(
+            decoder=decoder,
+            positions=xyz[occupied],
+            triplane=triplane,
+        )
+        density_act[occupied] = mlp_out["density_act"]
+        color[occupied] = mlp_out["color"]
+        return density_act, color
+
+    def _composite_weights(self, density_act: torch.Tensor, deltas: torch.Tensor):
+        # (N_rays, N_samples) density and interval lengths to compositing weights
+        alpha = 1 - torch.exp(-deltas * density_act)  # (N_rays, N_samples)
+        accum_prod = torch.cat(
+            [
+                torch.ones_like(alpha[:, :1]),
+                torch.cumprod(1 - alpha[:, :-1] + self.eps, dim=-1),
+            ],
+            dim=-1,
+        )
+        return alpha * accum_prod  # (N_rays, N_samples)
+
+    def _composite_importance(
+        self,
+        decoder: torch.nn.Module,
+        triplane: torch.Tensor,
+        rays_o: torch.Tensor,
+        rays_d: torch.Tensor,
+        t_near: torch.Tensor,
+        t_far: torch.Tensor,
+        occupancy_grid: Optional[torch.Tensor] = None,
+    ):
+        """
+        Two-stage sampling: num_coarse_samples uniform samples give weights
+        that are used as a piecewise constant PDF along each ray, and
+        num_fine_samples are placed by inverting its CDF. Both sets are
+        composited together, each sample covering the interval between the
+        midpoints to its neighbours. Positions are in the same normalized
+        [0, 1] ray parameter as the uniform sampler, so densities integrate
+        alike.
+        """
+        n_rays = rays_o.shape[0]
+        n_coarse, n_fine = self.num_coarse_samples, self.num_fine_samples
+
+        def positions(t):
+            z_vals = t_near * (1 - t) + t_far * t
+            return rays_o[:, None, :] + z_vals[..., None] * rays_d[:, None, :]
+
+        bins = torch.linspace(0, 1, n_coarse + 1, device=rays_o.device)
+        t_coarse = ((bins[:-1] + bins[1:]) / 2.0).expand(n_rays, n_coarse)
+        density_act, color = self._query_samples(
+            decoder, triplane, positions(t_coarse), occupancy_grid
+        )
+
+        if n_fine > 0:
+            weights = self._composite_weights(density_act[..., 0], bins[1:] - bins[:-1])
+            # small floor so rays through empty space still spread their samples
+            pdf = weights + 1e-5
+            pdf = pdf / pdf.sum(dim=-1, keepdim=True)
+            cdf = torch.cat([torch.zeros_like(pdf[:, :1]), pdf.cumsum(dim=-1)], dim=-1)
+            u = (torch.arange(n_fine, device=rays_o.device) + 0.5) / n_fine
+            u = u.expand(n_rays, n_fine).contiguous()
+            idx = torch.searchsorted(cdf, u, right=True).clamp(1, n_coarse)
+            cdf0, cdf1 = cdf.gather(-1, idx - 1), cdf.gather(-1, idx)
+            t_fine = bins[idx - 1] + (u - cdf0) / (cdf1 - cdf0).clamp_min(
+                1e-10
+            ) * (bins[idx] - bins[idx - 1])
+
+            density_fine, color_fine = self._query_samples(
+                decoder, triplane, positions(t_fine), occupancy_grid
+            )
+            t_vals, order = torch.sort(torch.cat([t_coarse, t_fine], dim=-1), dim=-1)
+            density_act = torch.cat([density_act, density_fine], dim=1).gather(
+                1, order[..., None]
+            )
+            color = torch.cat([color, color_fine], dim=1).gather(
+                1, order[..., None].expand(-1, -1, 3)
+            )
+        else:
+            t_vals = t_coarse
+
+        bounds = torch.cat(
+            [
+                torch.zeros_like(t_vals[:, :1]),
+                (t_vals[:, 1:] + t_vals[:, :-1]) / 2.0,
+                torch.ones_like(t_vals[:, :1]),
+            ],
+            dim=-1,
+        )
+        weights = self._composite_weights(
+            density_act[..., 0], bounds[:, 1:] - bounds[:, :-1]
+        )
+        comp_rgb = (weights[..., None] * color).sum(dim=-2)
+        return comp_rgb, weights.sum(dim=-1)
+
+    def _composite_blocks(
+        self,
+        decoder: torch.nn.Module,
+        triplane: torch.Tensor,
+        rays_o: torch.Tensor,
+        rays_d: torch.Tensor,
+        t_near: torch.Tensor,
+        t_far: torch.Tensor,
+        t_mid: torch.Tensor,
+        deltas: torch.Tensor,
+        occupancy_grid: Optional[torch.Tensor] = None,
+    ):
+        """
+        Front-to-back compositing of the same samples as _forward, marched in
+        blocks of termination_block_size samples. The transmittance is carried
+        across blocks, so the weights are the ones of the full cumprod; rays
+        whose transmittance fell below termination_threshold leave the active
+        set and are not queried any further.
+        """
+        n_rays = rays_o.shape[0]
+        comp_rgb = rays_o.new_zeros((n_rays, 3))
+        opacity = rays_o.new_zeros((n_rays,))
+        transmittance = rays_o.new_ones((n_rays,))
+        active = torch.arange(n_rays, device=rays_o.device)
+
+        block = self.termination_block_size
+        for start in range(0, t_mid.shape[0], block):
+            if active.numel() == 0:
+                break
+            t_mid_ = t_mid[start : start + block]
+            z_vals = t_near[active] * (1 - t_mid_[None]) + t_far[active] * t_mid_[None]
+            xyz = rays_o[active][:, None, :] + z_vals[..., None] * rays_d[active][:, None, :]
+
+            density_act, color = self._query_samples(
+                decoder, triplane, xyz, occupancy_grid
+            )
+            alpha = 1 - torch.exp(-deltas[start : start + block] * density_act[..., 0])
+            accum_prod = transmittance[active][:, None] * torch.cat(
+                [
+                    torch.ones_like(alpha[:, :1]),
+                    torch.cumprod(1 - alpha[:, :-1] + self.eps, dim=-1),
+                ],
+                dim=-1,
+            )
+            weights = alpha * accum_prod
+            comp_rgb[active] += (weights[..., None] * color).sum(dim=-2)
+            opacity[active] += weights.sum(dim=-1)
+            transmittance[active] = accum_prod[:, -1] * (1 - alpha[:, -1] + self.eps)
+
+            active = active[transmittance[active] >= self.termination_threshold]
+
+        return comp_rgb, opacity
+
     def _forward(
         self,
         decoder: torch.nn.Module,
         triplane: torch.Tensor,
         rays_o: torch.Tensor,
         rays_d: torch.Tensor,
+        occupancy_grid: Optional[torch.Tensor] = None,
+        t_near: Optional[torch.Tensor] = None,
+        t_far: Optional[torch.Tensor] = None,
+        rays_valid: Optional[torch.Tensor] = None,
         **kwargs,
     ):
         rays_shape = rays_o.shape[:-1]
-        rays_o = rays_o.view(-1, 3)
-        rays_d = rays_d.view(-1, 3)
+        rays_o = rays_o.reshape(-1, 3)
+        rays_d = rays_d.reshape(-1, 3)
         n_rays = rays_o.shape[0]
 
-        t_near, t_far, rays_valid = rays_intersect_bbox(rays_o, rays_d, self.cfg.radius)
+        if rays_valid is None:
+            t_near, t_far, rays_valid = rays_intersect_bbox(
+                rays_o, rays_d, self.cfg.radius
+            )
+        else:
+            # precomputed for these rays, e.g. by tsr.cache.RayBundleCache
+            t_near, t_far = t_near.reshape(-1, 1), t_far.reshape(-1, 1)
+            rays_valid = rays_valid.reshape(-1)
         t_near, t_far = t_near[rays_valid], t_far[rays_valid]
 
         t_vals = torch.linspace(
             0, 1, self.cfg.num_samples_per_ray + 1, device=triplane.device
         )
         t_mid = (t_vals[:-1] + t_vals[1:]) / 2.0
-        z_vals = t_near * (1 - t_mid[None]) + t_far * t_mid[None]  # (N_rays, N_samples)
+        # deltas = z_vals[:, 1:] - z_vals[:, :-1] # (N_rays, N_samples)
+        deltas = t_vals[1:] - t_vals[:-1]  # (N_rays, N_samples)
 
-        xyz = (
-            rays_o[:, None, :] + z_vals[..., None] * rays_d[..., None, :]
-        )  # (N_rays, N_sample, 3)
+        if self.num_coarse_samples > 0:
+            comp_rgb_, opacity_ = self._composite_importance(
+                decoder,
+                triplane,
+                rays_o[rays_valid],
+                rays_d[rays_valid],
+                t_near,
+                t_far,
+                occupancy_grid,
+            )
+        elif self.termination_threshold > 0:
+            comp_rgb_, opacity_ = self._composite_blocks(
+                decoder,
+                triplane,
+                rays_o[rays_valid],
+                rays_d[rays_valid],
+                t_near,
+                t_far,
+                t_mid,
+                deltas,
+                occupancy_grid,
+            )
+        else:
+            z_vals = t_near * (1 - t_mid[None]) + t_far * t_mid[None]  # (N_rays, N_samples)
 
-        mlp_out = self.query_triplane(
-            decoder=decoder,
-            positions=xyz,
-            triplane=triplane,
-        )
+            xyz = (
+                rays_o[rays_valid][:, None, :]
+                + z_vals[..., None] * rays_d[rays_valid][..., None, :]
+            )  # (N_rays, N_sample, 3)
 
-        eps = 1e-10
-        # deltas = z_vals[:, 1:] - z_vals[:, :-1] # (N_rays, N_samples)
-        deltas = t_vals[1:] - t_vals[:-1]  # (N_rays, N_samples)
-        alpha = 1 - torch.exp(
-            -deltas * mlp_out["density_act"][..., 0]
-        )  # (N_rays, N_samples)
-        accum_prod = torch.cat(
-            [
-                torch.ones_like(alpha[:, :1]),
-                torch.cumprod(1 - alpha[:, :-1] + eps, dim=-1),
-            ],
-            dim=-1,
-        )
-        weights = alpha * accum_prod  # (N_rays, N_samples)
-        comp_rgb_ = (weights[..., None] * mlp_out["color"]).sum(dim=-2)  # (N_rays, 3)
-        opacity_ = weights.sum(dim=-1)  # (N_rays)
+            density_act, color = self._query_samples(
+                decoder, triplane, xyz, occupancy_grid
+            )
+
+            weights = self._composite_weights(density_act[..., 0], deltas)
+            comp_rgb_ = (weights[..., None] * color).sum(dim=-2)  # (N_rays, 3)
+            opacity_ = weights.sum(dim=-1)  # (N_rays)
 
         comp_rgb = torch.zeros(
             n_rays, 3, dtype=comp_rgb_.dtype, device=comp_rgb_.device
@@ -161,13 +493,33 @@ class TriplaneNeRFRenderer(BaseModule):
         triplane: torch.Tensor,
         rays_o: torch.Tensor,
         rays_d: torch.Tensor,
+        occupancy_grid: Optional[torch.Tensor] = None,
+        **kwargs,
     ) -> Dict[str, torch.Tensor]:
+        # occupancy_grid comes from build_occupancy_grid, stacked for batches.
+        # kwargs may hold the precomputed t_near, t_far and rays_valid of the rays
         if triplane.ndim == 4:
-            comp_rgb = self._forward(decoder, triplane, rays_o, rays_d)
+            comp_rgb = self._forward(
+                decoder,
+                triplane,
+                rays_o,
+                rays_d,
+                occupancy_grid=occupancy_grid,
+                **kwargs,
+            )
         else:
             comp_rgb = torch.stack(
                 [
-                    self._forward(decoder, triplane[i], rays_o[i], rays_d[i])
+                    self._forward(
+                        decoder,
+                        triplane[i],
+                        rays_o[i],
+                        rays_d[i],
+                        occupancy_grid=None
+                        if occupancy_grid is None
+                        else occupancy_grid[i],
+                        **{k: v[i] for k, v in kwargs.items()},
+                    )
                     for i in range(triplane.shape[0])
                 ],
                 dim=0,
@@ -1,4 +1,7 @@
+import os
+import shutil
 from dataclasses import dataclass
+from typing import Optional
 
 import torch
 import torch.nn as nn
@@ -6,7 +9,7 @@ from einops import rearrange
 from huggingface_hub import hf_hub_download
 from transformers.models.vit.modeling_vit import ViTModel
 
-from ...utils import BaseModule
+from ...utils import BaseModule, parse_structured
 
 
 class DINOSingleImageTokenizer(BaseModule):
@@ -14,17 +17,33 @@ class DINOSingleImageTokenizer(BaseModule):
     class Config(BaseModule.Config):
         pretrained_model_name_or_path: str = "facebook/dino-vitb16"
         enable_gradient_checkpointing: bool = False
+        # local copy of the ViT config.json, skips the hub lookup when present
+        config_path: Optional[str] = None
+        local_files_only: bool = False
 
     cfg: Config
 
+    @staticmethod
+    def resolve_config_path(cfg: Config) -> str:
+        if cfg.config_path is not None and os.path.isfile(cfg.config_path):
+            return cfg.config_path
+        return hf_hub_download(
+            repo_id=cfg.pretrained_model_name_or_path,
+            filename="config.json",
+            local_files_only=cfg.local_files_only,
+        )
+
+    @classmethod
+    def save_config(cls, cfg, save_dir: str) -> str:
+        # copy the ViT config next to the model weights for offline builds
+        cfg = parse_structured(cls.Config, cfg)
+        config_path = os.path.join(save_dir, "image_tokenizer_config.json")
+        shutil.copyfile(cls.resolve_config_path(cfg), config_path)
+        return config_path
+
     def configure(self) -> None:
         self.model: ViTModel = ViTModel(
-            ViTModel.config_class.from_pretrained(
-                hf_hub_download(
-                    repo_id=self.cfg.pretrained_model_name_or_path,
-                    filename="config.json",
-                )
-            )
+            ViTModel.config_class.from_pretrained(self.resolve_config_path(self.cfg))
         )
 
         if self.cfg.enable_gradient_checkpointing:
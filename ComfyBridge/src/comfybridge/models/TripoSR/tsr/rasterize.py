@@ -0,0 +1,131 @@
+"""
+Small numpy triangle rasteriser for places where a GL context is not wanted.
+
+Triangles are expanded into the pixels of their bounding boxes, pixel centers
+inside a triangle become fragments and one fragment is kept per pixel: the
+nearest one when depths are given, else the one of the last triangle, like
+painting the triangles in order. Attributes are interpolated linearly in
+screen space.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def rasterize(
+    positions: np.ndarray,
+    faces: np.ndarray,
+    attributes: np.ndarray,
+    height: int,
+    width: int,
+    depth: Optional[np.ndarray] = None,
+    out: Optional[np.ndarray] = None,
+    max_fragments: int = 1 << 22,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    positions: (N, 2) pixel coordinates, x to the right and y down, the
+        center of pixel (i, j) at (i + 0.5, j + 0.5)
+    faces: (F, 3) vertex indices
+    attributes: (N, C) per-vertex values to interpolate
+    depth: optional (N,) per-vertex depth for the z-test
+    out: optional (height, width, C) image to draw into
+    max_fragments: candidate pixels processed at once, bounds memory
+
+    Returns the (height, width, C) image and the (height, width) mask of
+    covered pixels.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    attributes = np.asarray(attributes)
+    faces = np.asarray(faces, dtype=np.int64)
+    n_channels = attributes.shape[-1]
+    if out is None:
+        out = np.zeros((height, width, n_channels), dtype=np.float32)
+    covered = np.zeros(height * width, dtype=bool)
+    zbuffer = np.full(height * width, np.inf) if depth is not None else None
+    out_flat = out.reshape(-1, n_channels)
+
+    tri = positions[faces]  # (F, 3, 2)
+    area = (tri[:, 1, 0] - tri[:, 0, 0]) * (tri[:, 2, 1] - tri[:, 0, 1]) - (
+        tri[:, 1, 1] - tri[:, 0, 1]
+    ) * (tri[:, 2, 0] - tri[:, 0, 0])
+    # first and last pixel whose center lies in the bounding box
+    x0 = np.clip(np.ceil(tri[..., 0].min(axis=1) - 0.5), 0, width).astype(np.int64)
+    x1 = np.clip(np.floor(tri[..., 0].max(axis=1) - 0.5), -1, width - 1).astype(np.int64)
+    y0 = np.clip(np.ceil(tri[..., 1].min(axis=1) - 0.5), 0, height).astype(np.int64)
+    y1 = np.clip(np.floor(tri[..., 1].max(axis=1) - 0.5), -1, height - 1).astype(np.int64)
+    nx = np.maximum(x1 - x0 + 1, 0)
+    ny = np.maximum(y1 - y0 + 1, 0)
+    counts = np.where(np.abs(area) > 1e-12, nx * ny, 0)
+
+    # triangles in order, in batches of about max_fragments candidates
+    ends = np.cumsum(counts)
+    start = 0
+    while start < faces.shape[0]:
+        base = ends[start - 1] if start > 0 else 0
+        stop = max(int(np.searchsorted(ends, base + max_fragments, side="right")), start + 1)
+        _rasterize_batch(
+            np.arange(start, stop), counts, x0, y0, nx, tri, area, faces,
+            attributes, depth, width, out_flat, covered, zbuffer,
+        )
+        start = stop
+
+    return out, covered.reshape(height, width)
+
+
+def _rasterize_batch(
+    tids, counts, x0, y0, nx, tri, area, faces, attributes, depth, width,
+    out_flat, covered, zbuffer,
+):
+    n = counts[tids]
+    total = int(n.sum())
+    if total == 0:
+        return
+    tid = np.repeat(tids, n)
+    local = np.arange(total) - np.repeat(np.cumsum(n) - n, n)
+    px = x0[tid] + local % nx[tid]
+    py = y0[tid] + local // nx[tid]
+    cx, cy = px + 0.5, py + 0.5
+
+    a, b, c = tri[tid, 0], tri[tid, 1], tri[tid, 2]
+
+    def edge(p, q):
+        return (q[:, 0] - p[:, 0]) * (cy - p[:, 1]) - (q[:, 1] - p[:, 1]) * (cx - p[:, 0])
+
+    inv_area = 1.0 / area[tid]
+    l0 = edge(b, c) * inv_area
+    l1 = edge(c, a) * inv_area
+    l2 = edge(a, b) * inv_area
+    inside = (l0 >= -1e-9) & (l1 >= -1e-9) & (l2 >= -1e-9)
+    if not inside.any():
+        return
+    tid, l0, l1, l2 = tid[inside], l0[inside], l1[inside], l2[inside]
+    pix = (py * width + px)[inside]
+    f = faces[tid]
+
+    if depth is not None:
+        z = l0 * depth[f[:, 0]] + l1 * depth[f[:, 1]] + l2 * depth[f[:, 2]]
+        # nearest fragment first
+        order = np.lexsort((z, pix))
+        pix_sorted = pix[order]
+        keep = np.ones(order.shape[0], dtype=bool)
+        keep[1:] = pix_sorted[1:] != pix_sorted[:-1]
+    else:
+        # fragments come in triangle order, a stable sort keeps it per pixel
+        # and the last fragment of every pixel wins
+        order = np.argsort(pix, kind="stable")
+        pix_sorted = pix[order]
+        keep = np.ones(order.shape[0], dtype=bool)
+        keep[:-1] = pix_sorted[1:] != pix_sorted[:-1]
+    keep = order[keep]
+    if depth is not None:
+        keep = keep[z[keep] < zbuffer[pix[keep]]]
+        zbuffer[pix[keep]] = z[keep]
+
+    value = (
+        l0[keep, None] * attributes[f[keep, 0]]
+        + l1[keep, None] * attributes[f[keep, 1]]
+        + l2[keep, None] * attributes[f[keep, 2]]
+    )
+    out_flat[pix[keep]] = value
+    covered[pix[keep]] = True
@@ -1,7 +1,10 @@
+import hashlib
+import json
+import logging
 import math
 import os
 from dataclasses import dataclass, field
-from typing import List, Union
+from typing import List, Optional, Union
 
 import numpy as np
 import PIL.Image
@@ -9,7 +12,7 @@ import torch
 import torch.nn.functional as F
 import trimesh
 from einops import rearrange
-from huggingface_hub import hf_hub_download
+from huggingface_hub import hf_hub_download, try_to_load_from_cache
 from omegaconf import OmegaConf
 from PIL import Image
 
@@ -23,6 +26,42 @@ from .utils import (
 )
 
 
+def weight_fingerprint(weight_path: str) -> str:
+    # hub cache files link to blobs named by the hash of their content,
+    # other files are told apart by size and modification time
+    real_path = os.path.realpath(weight_path)
+    if os.path.basename(os.path.dirname(real_path)) == "blobs":
+        return f"blob:{os.path.basename(real_path)}"
+    stat = os.stat(real_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_model_config(config_path: str):
+    cfg = OmegaConf.load(config_path)
+    OmegaConf.resolve(cfg)
+    return cfg
+
+
+def model_fingerprint(weight_path: str, cfg) -> str:
+    # weights and resolved config, taken before the loader adds its runtime
+    # settings to the config
+    cfg_hash = hashlib.sha1(
+        OmegaConf.to_yaml(cfg, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return f"{weight_fingerprint(weight_path)}:config-{cfg_hash}"
+
+
+def local_file_path(pretrained_model_name_or_path: str, filename: str):
+    # the model file the model would load, found without the network, or None
+    if os.path.isdir(pretrained_model_name_or_path):
+        path = os.path.join(pretrained_model_name_or_path, filename)
+    else:
+        path = try_to_load_from_cache(pretrained_model_name_or_path, filename)
+    if isinstance(path, str) and os.path.isfile(path):
+        return path
+    return None
+
+
 class TSR(BaseModule):
     @dataclass
     class Config(BaseModule.Config):
@@ -50,26 +89,147 @@ class TSR(BaseModule):
 
     @classmethod
     def from_pretrained(
-        cls, pretrained_model_name_or_path: str, config_name: str, weight_name: str
+        cls,
+        pretrained_model_name_or_path: str,
+        config_name: str,
+        weight_name: str,
+        snapshot_dir: Optional[str] = None,
+        local_files_only: bool = False,
     ):
+        # With a snapshot_dir, the first load also writes the resolved config, the
+        # image tokenizer config and a zipfile copy of the weights there. Later
+        # loads need no network, build the modules on the meta device and
+        # memory-map the snapshot straight into them.
+        # The snapshot is rebuilt when the weights or the config it was made
+        # from changed.
+        # local_files_only never touches the network, hub files must be cached.
+        source = f"{pretrained_model_name_or_path}/{config_name}/{weight_name}"
+        if snapshot_dir is not None:
+            weight_path = local_file_path(pretrained_model_name_or_path, weight_name)
+            config_path = local_file_path(pretrained_model_name_or_path, config_name)
+            try:
+                fingerprint = None
+                if weight_path is not None and config_path is not None:
+                    fingerprint = model_fingerprint(
+                        weight_path, load_model_config(config_path)
+                    )
+                model = cls.from_snapshot(
+                    snapshot_dir, source, fingerprint, local_files_only
+                )
+            except (OSError, RuntimeError, ValueError, KeyError) as e:
+                logging.warning(f"Ignoring model snapshot in {snapshot_dir}: {e}")
+                model = None
+            if model is not None:
+                return model
+
         if os.path.isdir(pretrained_model_name_or_path):
             config_path = os.path.join(pretrained_model_name_or_path, config_name)
             weight_path = os.path.join(pretrained_model_name_or_path, weight_name)
         else:
             config_path = hf_hub_download(
-                repo_id=pretrained_model_name_or_path, filename=config_name
+                repo_id=pretrained_model_name_or_path,
+                filename=config_name,
+                local_files_only=local_files_only,
             )
             weight_path = hf_hub_download(
-                repo_id=pretrained_model_name_or_path, filename=weight_name
+                repo_id=pretrained_model_name_or_path,
+                filename=weight_name,
+                local_files_only=local_files_only,
             )
 
-        cfg = OmegaConf.load(config_path)
-        OmegaConf.resolve(cfg)
+        cfg = load_model_config(config_path)
+        fingerprint = model_fingerprint(weight_path, cfg)
+        cfg.image_tokenizer.local_files_only = local_files_only
+        image_tokenizer_cls = find_class(cfg.image_tokenizer_cls)
+        if snapshot_dir is not None and hasattr(image_tokenizer_cls, "save_config"):
+            os.makedirs(snapshot_dir, exist_ok=True)
+            cfg.image_tokenizer.config_path = image_tokenizer_cls.save_config(
+                cfg.image_tokenizer, snapshot_dir
+            )
         model = cls(cfg)
         ckpt = torch.load(weight_path, map_location="cpu")
         model.load_state_dict(ckpt)
+        model.model_id = f"{pretrained_model_name_or_path}/{weight_name}:{fingerprint}"
+
+        if snapshot_dir is not None:
+            model.save_snapshot(snapshot_dir, cfg, source, fingerprint)
+        return model
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        snapshot_dir: str,
+        source: str,
+        fingerprint: Optional[str] = None,
+        local_files_only: bool = False,
+    ):
+        # fingerprint of the weights and the config the snapshot must match,
+        # None when they are not available locally and the snapshot is all
+        # there is
+        meta_path = os.path.join(snapshot_dir, "snapshot.json")
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["source"] != source:
+            return None
+        if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+            logging.info(f"Model changed since the snapshot in {snapshot_dir}, rebuilding it.")
+            return None
+
+        cfg = OmegaConf.load(os.path.join(snapshot_dir, "config.yaml"))
+        cfg.image_tokenizer.local_files_only = local_files_only
+        if cfg.image_tokenizer.get("config_path") is not None:
+            # stored by name, the snapshot directory may have moved
+            cfg.image_tokenizer.config_path = os.path.join(
+                snapshot_dir, os.path.basename(cfg.image_tokenizer.config_path)
+            )
+        with torch.device("meta"):
+            model = cls(cfg)
+        state = torch.load(
+            os.path.join(snapshot_dir, "model.pt"),
+            map_location="cpu",
+            mmap=True,
+            weights_only=True,
+        )
+        # assign instead of load_state_dict's copy, the tensors stay file-backed
+        for name, tensor in state.items():
+            module_name, _, attr = name.rpartition(".")
+            module = model.get_submodule(module_name)
+            if attr in module._parameters:
+                module._parameters[attr] = torch.nn.Parameter(
+                    tensor, requires_grad=module._parameters[attr].requires_grad
+                )
+            else:
+                module._buffers[attr] = tensor
+        missing = [
+            name
+            for name, tensor in list(model.named_parameters()) + list(model.named_buffers())
+            if tensor.is_meta
+        ]
+        if len(missing) > 0:
+            raise RuntimeError(f"snapshot is missing {missing}")
+
+        model.model_id = meta["model_id"]
         return model
 
+    def save_snapshot(self, snapshot_dir: str, cfg, source: str, fingerprint: str):
+        os.makedirs(snapshot_dir, exist_ok=True)
+        state = dict(self.state_dict())
+        # non-persistent buffers as well, so a meta-device model can be filled
+        for name, buffer in self.named_buffers():
+            state.setdefault(name, buffer)
+        weight_path = os.path.join(snapshot_dir, "model.pt")
+        torch.save(state, weight_path + ".tmp")
+        os.replace(weight_path + ".tmp", weight_path)
+        OmegaConf.save(cfg, os.path.join(snapshot_dir, "config.yaml"))
+        # written last, marks the snapshot as complete
+        with open(os.path.join(snapshot_dir, "snapshot.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {"source": source, "fingerprint": fingerprint, "model_id": self.model_id},
+                f,
+            )
+
     def configure(self):
         self.image_tokenizer = find_class(self.cfg.image_tokenizer_cls)(
             self.cfg.image_tokenizer
@@ -83,6 +243,9 @@ class TSR(BaseModule):
         self.renderer = find_class(self.cfg.renderer_cls)(self.cfg.renderer)
         self.image_processor = ImagePreprocessor()
         self.isosurface_helper = None
+        self.scene_code_cache = None
+        self.ray_cache = None
+        self.model_id = self.__class__.__name__
 
     def forward(
         self,
@@ -96,9 +259,25 @@ class TSR(BaseModule):
         ],
         device: str,
     ) -> torch.FloatTensor:
-        rgb_cond = self.image_processor(image, self.cfg.cond_image_size)[:, None].to(
-            device
-        )
+        rgb_cond = self.image_processor(image, self.cfg.cond_image_size)[:, None]
+        if self.scene_code_cache is None:
+            return self.encode(rgb_cond.to(device))
+
+        keys = [
+            self.scene_code_cache.key(rgb_cond[i], self.model_id)
+            for i in range(rgb_cond.shape[0])
+        ]
+        scene_codes = [self.scene_code_cache.get(key) for key in keys]
+        missing = [i for i, scene_code in enumerate(scene_codes) if scene_code is None]
+        if len(missing) > 0:
+            computed = self.encode(rgb_cond[missing].to(device))
+            for i, scene_code in zip(missing, computed):
+                self.scene_code_cache.put(keys[i], scene_code)
+                scene_codes[i] = scene_code
+        return torch.stack([scene_code.to(device) for scene_code in scene_codes], dim=0)
+
+    def encode(self, rgb_cond: torch.FloatTensor) -> torch.FloatTensor:
+        # rgb_cond: (B, 1, H, W, C) preprocessed conditioning images
         batch_size = rgb_cond.shape[0]
 
         input_image_tokens: torch.Tensor = self.image_tokenizer(
@@ -119,6 +298,30 @@ class TSR(BaseModule):
         scene_codes = self.post_processor(self.tokenizer.detokenize(tokens))
         return scene_codes
 
+    @staticmethod
+    def mirror_scene_codes(scene_codes: torch.FloatTensor) -> torch.FloatTensor:
+        # A horizontal flip of the input image mirrors the scene across y: the
+        # conditioning camera looks down -x with +y to its right. The planes are
+        # (xy, xz, yz), sampled with the first coordinate along the width.
+        plane_xy, plane_xz, plane_yz = scene_codes.unbind(dim=-4)
+        return torch.stack(
+            [plane_xy.flip(-2), plane_xz, plane_yz.flip(-1)], dim=-4
+        )
+
+    def fuse_scene_codes(
+        self,
+        scene_codes: torch.FloatTensor,
+        mirrored: Optional[List[int]] = None,
+    ) -> torch.FloatTensor:
+        # ensemble of views of the same object: un-mirror the flipped views and
+        # average all triplanes into a single scene code of batch size 1
+        mirrored = set(mirrored or [])
+        aligned = [
+            self.mirror_scene_codes(scene_code) if i in mirrored else scene_code
+            for i, scene_code in enumerate(scene_codes)
+        ]
+        return torch.stack(aligned, dim=0).mean(dim=0, keepdim=True)
+
     def render(
         self,
         scene_codes,
@@ -130,10 +333,24 @@ class TSR(BaseModule):
         width: int = 256,
         return_type: str = "pil",
     ):
-        rays_o, rays_d = get_spherical_cameras(
-            n_views, elevation_deg, camera_distance, fovy_deg, height, width
-        )
-        rays_o, rays_d = rays_o.to(scene_codes.device), rays_d.to(scene_codes.device)
+        if self.ray_cache is not None:
+            bundle = self.ray_cache.get(
+                device=scene_codes.device,
+                n_views=n_views,
+                elevation_deg=elevation_deg,
+                camera_distance=camera_distance,
+                fovy_deg=fovy_deg,
+                height=height,
+                width=width,
+                radius=self.renderer.cfg.radius,
+            )
+            rays_o, rays_d = bundle.pop("rays_o"), bundle.pop("rays_d")
+        else:
+            rays_o, rays_d = get_spherical_cameras(
+                n_views, elevation_deg, camera_distance, fovy_deg, height, width
+            )
+            rays_o, rays_d = rays_o.to(scene_codes.device), rays_d.to(scene_codes.device)
+            bundle = {}
 
         def process_output(image: torch.FloatTensor):
             if return_type == "pt":
@@ -147,18 +364,54 @@ class TSR(BaseModule):
             else:
                 raise NotImplementedError
 
+        # the rays of all views are stacked and go through the renderer in
+        # groups of at most chunk_size rays (all at once with chunk_size 0),
+        # so the per-sample tensors do not grow with n_views. Rays are
+        # composited independently, the grouping does not change the image.
+        # Scene codes still run one after the other as each has its own triplane
+        rays_shape = rays_o.shape[:-1]
+        rays = {"rays_o": rays_o, "rays_d": rays_d, **bundle}
+        rays = {k: v.flatten(0, len(rays_shape) - 1) for k, v in rays.items()}
+        n_rays = rays["rays_o"].shape[0]
+        group_size = self.renderer.chunk_size or n_rays
+        groups = [
+            {k: v[start : start + group_size] for k, v in rays.items()}
+            for start in range(0, n_rays, group_size)
+        ]
+
         images = []
         for scene_code in scene_codes:
-            images_ = []
-            for i in range(n_views):
-                with torch.no_grad():
-                    image = self.renderer(
-                        self.decoder, scene_code, rays_o[i], rays_d[i]
-                    )
-                images_.append(process_output(image))
-            images.append(images_)
+            with torch.no_grad():
+                # shared by all views of this scene code
+                occupancy_grid = self.renderer.build_occupancy_grid(
+                    self.decoder, scene_code
+                )
+                image = torch.cat(
+                    [
+                        self.renderer(
+                            self.decoder,
+                            scene_code,
+                            occupancy_grid=occupancy_grid,
+                            **group,
+                        )
+                        for group in groups
+                    ],
+                    dim=0,
+                )
+                images.append(image.view(*rays_shape, 3))  # (n_views, height, width, 3)
+
+        if return_type == "stacked":
+            # (B, n_views, height, width, 3) tensor
+            return torch.stack(images, dim=0)
+        return [[process_output(image) for image in images_] for images_ in images]
 
-        return images
+    def set_scene_code_cache(self, cache):
+        # a tsr.cache.SceneCodeCache, or None to always run the backbone
+        self.scene_code_cache = cache
+
+    def set_ray_cache(self, cache):
+        # a tsr.cache.RayBundleCache, or None to build the camera rays every render
+        self.ray_cache = cache
 
     def set_marching_cubes_resolution(self, resolution: int):
         if (
@@ -168,28 +421,91 @@ class TSR(BaseModule):
             return
         self.isosurface_helper = MarchingCubeHelper(resolution)
 
-    def extract_mesh(self, scene_codes, has_vertex_color, resolution: int = 256, threshold: float = 25.0):
+    def query_level(
+        self,
+        scene_code,
+        threshold: float,
+        points: torch.FloatTensor,
+        return_color: bool = False,
+    ):
+        # level of the isosurface helper at points in its points_range,
+        # optionally with the colors decoded in the same MLP call
+        out = self.renderer.query_triplane(
+            self.decoder,
+            scale_tensor(
+                points,
+                self.isosurface_helper.points_range,
+                (-self.renderer.cfg.radius, self.renderer.cfg.radius),
+            ),
+            scene_code,
+        )
+        level = -(out["density_act"] - threshold)
+        if return_color:
+            return level, out["color"]
+        return level
+
+    def extract_mesh(
+        self,
+        scene_codes,
+        has_vertex_color,
+        resolution: int = 256,
+        threshold: float = 25.0,
+        method: str = "dense",
+        num_workers: int = 0,
+        color_grid: bool = False,
+    ):
+        # method: "dense" queries every grid vertex, "adaptive" refines a coarse
+        # grid only around the isosurface (see MarchingCubeHelper.adaptive_level),
+        # "streaming" queries and polygonises the grid slab by slab.
+        # num_workers > 1 polygonises dense and adaptive grids on a process pool.
+        # color_grid (dense only) keeps the colors of the grid query as uint8 and
+        # interpolates vertex colors from them instead of querying the vertices
         self.set_marching_cubes_resolution(resolution)
+        res = self.isosurface_helper.resolution
         meshes = []
         for scene_code in scene_codes:
+            colors = None
             with torch.no_grad():
-                density = self.renderer.query_triplane(
-                    self.decoder,
-                    scale_tensor(
+                if method == "dense" and has_vertex_color and color_grid:
+                    level, colors = self.query_level(
+                        scene_code,
+                        threshold,
                         self.isosurface_helper.grid_vertices.to(scene_codes.device),
-                        self.isosurface_helper.points_range,
-                        (-self.renderer.cfg.radius, self.renderer.cfg.radius),
-                    ),
-                    scene_code,
-                )["density_act"]
-            v_pos, t_pos_idx = self.isosurface_helper(-(density - threshold))
+                        return_color=True,
+                    )
+                    colors = (colors * 255.0).round().to(torch.uint8)
+                    colors = colors.view(res, res, res, 3)
+                    v_pos, t_pos_idx = self.isosurface_helper(level, num_workers)
+                elif method == "dense":
+                    level = self.query_level(
+                        scene_code,
+                        threshold,
+                        self.isosurface_helper.grid_vertices.to(scene_codes.device),
+                    )
+                    v_pos, t_pos_idx = self.isosurface_helper(level, num_workers)
+                elif method == "adaptive":
+                    level = self.isosurface_helper.adaptive_level(
+                        lambda points: self.query_level(scene_code, threshold, points),
+                        device=scene_codes.device,
+                    )
+                    v_pos, t_pos_idx = self.isosurface_helper(level, num_workers)
+                elif method == "streaming":
+                    v_pos, t_pos_idx = self.isosurface_helper.stream(
+                        lambda points: self.query_level(scene_code, threshold, points),
+                        device=scene_codes.device,
+                    )
+                else:
+                    raise NotImplementedError
+            color = None
+            if colors is not None:
+                # at the same points the vertex query below would decode
+                color = self.isosurface_helper.interpolate(colors, v_pos) / 255.0
             v_pos = scale_tensor(
                 v_pos,
                 self.isosurface_helper.points_range,
                 (-self.renderer.cfg.radius, self.renderer.cfg.radius),
             )
-            color = None
-            if has_vertex_color:
+            if has_vertex_color and color is None:
                 with torch.no_grad():
                     color = self.renderer.query_triplane(
                         self.decoder,
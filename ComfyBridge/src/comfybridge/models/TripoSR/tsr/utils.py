@@ -1,6 +1,8 @@
 import importlib
 import math
-from collections import defaultdict
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
@@ -151,9 +153,60 @@ def rays_intersect_bbox(
     return t_near, t_far, rays_valid
 
 
-def chunk_batch(func: Callable, chunk_size: int, *args, **kwargs) -> Any:
+# kept alive between calls, see chunk_batch(num_workers=...)
+_chunk_pool = None
+
+
+def _get_chunk_pool(num_workers: int) -> ThreadPoolExecutor:
+    global _chunk_pool
+    if _chunk_pool is None or _chunk_pool[0] != num_workers:
+        if _chunk_pool is not None:
+            _chunk_pool[1].shutdown()
+        _chunk_pool = (num_workers, ThreadPoolExecutor(max_workers=num_workers))
+    return _chunk_pool[1]
+
+
+def _slice_chunk(args, kwargs, i: int, chunk_size: int):
+    return (
+        [arg[i : i + chunk_size] if isinstance(arg, torch.Tensor) else arg for arg in args],
+        {
+            k: arg[i : i + chunk_size] if isinstance(arg, torch.Tensor) else arg
+            for k, arg in kwargs.items()
+        },
+    )
+
+
+def chunk_batch(
+    func: Callable,
+    chunk_size: int,
+    *args,
+    out: Any = None,
+    num_workers: int = 0,
+    **kwargs,
+) -> Any:
+    """
+    Calls func on slices of chunk_size rows of the tensor arguments and
+    returns its outputs concatenated along the first dimension. Outputs are
+    written in place into tensors allocated from the shapes of the first
+    chunk, or into the caller's out buffers, laid out like the return value
+    of func (tensor, list, tuple or dict of tensors).
+
+    With num_workers > 1 the chunks after the first run on a thread pool and
+    write into disjoint slices of the outputs; torch's intra-op threads are
+    shared out between the workers for the duration of the call. This needs
+    func to return one output row per input row, other functions run
+    serially. Memory grows with num_workers chunks in flight.
+    """
     if chunk_size <= 0:
-        return func(*args, **kwargs)
+        out_chunk = func(*args, **kwargs)
+        if out is None or out_chunk is None:
+            return out_chunk
+        chunk_dict, out_type = _as_output_dict(out_chunk)
+        out_dict, _ = _as_output_dict(out)
+        for k, v in chunk_dict.items():
+            if v is not None:
+                out_dict[k][: v.shape[0]].copy_(v)
+        return out
     B = None
     for arg in list(args) + list(kwargs.values()):
         if isinstance(arg, torch.Tensor):
@@ -162,53 +215,75 @@ def chunk_batch(func: Callable, chunk_size: int, *args, **kwargs) -> Any:
     assert (
         B is not None
     ), "No tensor found in args or kwargs, cannot determine batch size."
-    out = defaultdict(list)
+    out_dict = None if out is None else dict(_as_output_dict(out)[0])
     out_type = None
+    offsets: Dict[Any, int] = {}
+    if num_workers > 1:
+        # spread small queries over every worker too
+        chunk_size = min(chunk_size, max(1, -(-B // num_workers)))
     # max(1, B) to support B == 0
     for i in range(0, max(1, B), chunk_size):
-        out_chunk = func(
-            *[
-                arg[i : i + chunk_size] if isinstance(arg, torch.Tensor) else arg
-                for arg in args
-            ],
-            **{
-                k: arg[i : i + chunk_size] if isinstance(arg, torch.Tensor) else arg
-                for k, arg in kwargs.items()
-            },
-        )
+        args_, kwargs_ = _slice_chunk(args, kwargs, i, chunk_size)
+        out_chunk = func(*args_, **kwargs_)
         if out_chunk is None:
             continue
-        out_type = type(out_chunk)
-        if isinstance(out_chunk, torch.Tensor):
-            out_chunk = {0: out_chunk}
-        elif isinstance(out_chunk, tuple) or isinstance(out_chunk, list):
-            chunk_length = len(out_chunk)
-            out_chunk = {i: chunk for i, chunk in enumerate(out_chunk)}
-        elif isinstance(out_chunk, dict):
-            pass
-        else:
-            print(
-                f"Return value of func must be in type [torch.Tensor, list, tuple, dict], get {type(out_chunk)}."
-            )
-            exit(1)
+        out_chunk, out_type_ = _as_output_dict(out_chunk)
+        if out_type is None:
+            out_type = out_type_
+            if out_type in [tuple, list]:
+                chunk_length = len(out_chunk)
+            if out_dict is None:
+                out_dict = {}
+            n_in = min(chunk_size, B - i)
+            for k, v in out_chunk.items():
+                if out_dict.get(k) is None and isinstance(v, torch.Tensor):
+                    # rows of the full output, assuming every chunk scales alike
+                    rows = v.shape[0] if n_in == 0 else -(-B * v.shape[0] // n_in)
+                    out_dict[k] = v.new_empty((rows, *v.shape[1:]))
+                elif k not in out_dict:
+                    out_dict[k] = None
+                offsets[k] = 0
+
         for k, v in out_chunk.items():
+            if v is None and out_dict.get(k) is None:
+                # allow None in return value
+                continue
+            if not isinstance(v, torch.Tensor) or out_dict.get(k) is None:
+                raise TypeError(
+                    f"Unsupported types in return value of func: {type(v)}"
+                )
             v = v if torch.is_grad_enabled() else v.detach()
-            out[k].append(v)
+            start, stop = offsets[k], offsets[k] + v.shape[0]
+            if stop > out_dict[k].shape[0]:
+                if out is not None:
+                    raise ValueError(
+                        f"Output buffer {k} holds {out_dict[k].shape[0]} rows, {stop} needed."
+                    )
+                # chunk larger than estimated, grow the buffer
+                out_dict[k] = torch.cat(
+                    [out_dict[k][:start], v.new_empty((stop - start, *v.shape[1:]))]
+                )
+            out_dict[k][start:stop] = v
+            offsets[k] = stop
+
+        n_in = min(chunk_size, B - i)
+        if (
+            num_workers > 1
+            and i + chunk_size < B
+            and all(v is None or v.shape[0] == n_in for v in out_chunk.values())
+        ):
+            _run_chunks_parallel(
+                func, chunk_size, args, kwargs, i + chunk_size, B, out_dict, num_workers
+            )
+            offsets = {k: B for k in offsets}
+            break
 
     if out_type is None:
         return None
 
-    out_merged: Dict[Any, Optional[torch.Tensor]] = {}
-    for k, v in out.items():
-        if all([vv is None for vv in v]):
-            # allow None in return value
-            out_merged[k] = None
-        elif all([isinstance(vv, torch.Tensor) for vv in v]):
-            out_merged[k] = torch.cat(v, dim=0)
-        else:
-            raise TypeError(
-                f"Unsupported types in return value of func: {[type(vv) for vv in v if not isinstance(vv, torch.Tensor)]}"
-            )
+    out_merged: Dict[Any, Optional[torch.Tensor]] = {
+        k: None if v is None else v[: offsets[k]] for k, v in out_dict.items()
+    }
 
     if out_type is torch.Tensor:
         return out_merged[0]
@@ -218,6 +293,50 @@ def chunk_batch(func: Callable, chunk_size: int, *args, **kwargs) -> Any:
         return out_merged
 
 
+def _run_chunks_parallel(
+    func, chunk_size, args, kwargs, start, B, out_dict, num_workers
+) -> None:
+    # chunks from start on, each writing rows [i, i + chunk_size) of out_dict
+    grad_enabled = torch.is_grad_enabled()  # thread local, carried over
+
+    def run_chunk(i):
+        args_, kwargs_ = _slice_chunk(args, kwargs, i, chunk_size)
+        with torch.set_grad_enabled(grad_enabled):
+            out_chunk, _ = _as_output_dict(func(*args_, **kwargs_))
+        for k, v in out_chunk.items():
+            if v is None and out_dict.get(k) is None:
+                continue
+            if not isinstance(v, torch.Tensor) or out_dict.get(k) is None:
+                raise TypeError(
+                    f"Unsupported types in return value of func: {type(v)}"
+                )
+            out_dict[k][i : i + v.shape[0]] = v if grad_enabled else v.detach()
+
+    n_threads = torch.get_num_threads()
+    torch.set_num_threads(max(1, n_threads // num_workers))
+    try:
+        pool = _get_chunk_pool(num_workers)
+        futures = [pool.submit(run_chunk, i) for i in range(start, B, chunk_size)]
+        for future in futures:
+            future.result()
+    finally:
+        torch.set_num_threads(n_threads)
+
+
+def _as_output_dict(value: Any):
+    # chunk_batch return values as a dict, with the type to rebuild them
+    if isinstance(value, torch.Tensor):
+        return {0: value}, torch.Tensor
+    elif isinstance(value, tuple) or isinstance(value, list):
+        return {i: v for i, v in enumerate(value)}, type(value)
+    elif isinstance(value, dict):
+        return value, dict
+    print(
+        f"Return value of func must be in type [torch.Tensor, list, tuple, dict], get {type(value)}."
+    )
+    exit(1)
+
+
 ValidScale = Union[Tuple[float, float], torch.FloatTensor]
 
 
@@ -338,14 +457,15 @@ def get_rays(
     return rays_o, rays_d
 
 
-def get_spherical_cameras(
+def get_spherical_camera_poses(
     n_views: int,
     elevation_deg: float,
     camera_distance: float,
     fovy_deg: float,
     height: int,
-    width: int,
-):
+) -> Tuple[torch.FloatTensor, torch.FloatTensor]:
+    # (n_views, 4, 4) camera-to-world matrices of the turntable cameras and
+    # their focal lengths in pixels, cameras look down their -z axis
     azimuth_deg = torch.linspace(0, 360.0, n_views + 1)[:n_views]
     elevation_deg = torch.full_like(azimuth_deg, elevation_deg)
     camera_distances = torch.full_like(elevation_deg, camera_distance)
@@ -382,8 +502,23 @@ def get_spherical_cameras(
     c2w = torch.cat([c2w3x4, torch.zeros_like(c2w3x4[:, :1])], dim=1)
     c2w[:, 3, 3] = 1.0
 
-    # get directions by dividing directions_unit_focal by focal length
     focal_length = 0.5 * height / torch.tan(0.5 * fovy)
+    return c2w, focal_length
+
+
+def get_spherical_cameras(
+    n_views: int,
+    elevation_deg: float,
+    camera_distance: float,
+    fovy_deg: float,
+    height: int,
+    width: int,
+):
+    c2w, focal_length = get_spherical_camera_poses(
+        n_views, elevation_deg, camera_distance, fovy_deg, height
+    )
+
+    # get directions by dividing directions_unit_focal by focal length
     directions_unit_focal = get_ray_directions(
         H=height,
         W=width,
@@ -399,16 +534,18 @@ def get_spherical_cameras(
     return rays_o, rays_d
 
 
+def needs_background_removal(image: PIL.Image.Image) -> bool:
+    # an image with transparent pixels was cut out already
+    return not (image.mode == "RGBA" and image.getextrema()[3][0] < 255)
+
+
 def remove_background(
     image: PIL.Image.Image,
     rembg_session: Any = None,
     force: bool = False,
     **rembg_kwargs,
 ) -> PIL.Image.Image:
-    do_remove = True
-    if image.mode == "RGBA" and image.getextrema()[3][0] < 255:
-        do_remove = False
-    do_remove = do_remove or force
+    do_remove = needs_background_removal(image) or force
     if do_remove:
         image = rembg.remove(image, session=rembg_session, **rembg_kwargs)
     return image
@@ -468,6 +605,105 @@ def save_video(
     writer.close()
 
 
+class PNGWriter:
+    """
+    Writes an 8-bit RGB or RGBA PNG a band of rows at a time, compressing
+    the rows as they come so the whole image never has to be in memory.
+    Each row gets the None, Sub, Up or Paeth filter with the smallest sum of
+    absolute residuals, the usual PNG encoder heuristic.
+    """
+
+    SIGNATURE = b"\x89PNG\r\n\x1a\n"
+    COLOR_TYPES = {3: 2, 4: 6}
+
+    def __init__(
+        self,
+        path: str,
+        width: int,
+        height: int,
+        channels: int = 4,
+        compress_level: int = 6,
+        filter_rows: int = 64,
+    ):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.filter_rows = filter_rows
+        self.rows_written = 0
+        self.prev_row = np.zeros(width * channels, dtype=np.uint8)
+        self.compressor = zlib.compressobj(compress_level)
+        self.file = open(path, "wb")
+        self.file.write(self.SIGNATURE)
+        self._chunk(
+            b"IHDR",
+            struct.pack(
+                ">IIBBBBB", width, height, 8, self.COLOR_TYPES[channels], 0, 0, 0
+            ),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def _chunk(self, tag: bytes, data: bytes) -> None:
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(tag)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def _filter(self, rows: np.ndarray) -> np.ndarray:
+        c = self.channels
+        x = rows.astype(np.int16)
+        up = np.concatenate([self.prev_row[None].astype(np.int16), x[:-1]])
+        left = np.zeros_like(x)
+        left[:, c:] = x[:, :-c]
+        up_left = np.zeros_like(x)
+        up_left[:, c:] = up[:, :-c]
+        p = left + up - up_left
+        pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - up_left)
+        paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+        residuals = (np.stack([x, x - left, x - up, x - paeth]) & 0xFF).astype(np.uint8)
+        cost = np.abs(residuals.view(np.int8).astype(np.int32)).sum(axis=-1)
+        best = cost.argmin(axis=0)
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = np.array([0, 1, 2, 4], dtype=np.uint8)[best]
+        filtered[:, 1:] = residuals[best, np.arange(rows.shape[0])]
+        return filtered
+
+    def write(self, rows: np.ndarray) -> None:
+        """
+        rows: (h, width, channels) uint8, top row first
+        """
+        rows = np.ascontiguousarray(rows, dtype=np.uint8).reshape(rows.shape[0], -1)
+        if self.rows_written + rows.shape[0] > self.height:
+            raise ValueError(f"PNG is only {self.height} rows high")
+        data = []
+        for i in range(0, rows.shape[0], self.filter_rows):
+            group = rows[i : i + self.filter_rows]
+            data.append(self.compressor.compress(self._filter(group).tobytes()))
+            self.prev_row = group[-1]
+        data = b"".join(data)
+        if data:
+            self._chunk(b"IDAT", data)
+        self.rows_written += rows.shape[0]
+
+    def close(self) -> None:
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(
+                    f"PNG got {self.rows_written} of its {self.height} rows"
+                )
+            self._chunk(b"IDAT", self.compressor.flush())
+            self._chunk(b"IEND", b"")
+        finally:
+            self.file.close()
+
+
 def to_gradio_3d_orientation(mesh):
     mesh.apply_transform(trimesh.transformations.rotation_matrix(-np.pi/2, [1, 0, 0]))
     mesh.apply_transform(trimesh.transformations.rotation_matrix(np.pi/2, [0, 1, 0]))
@@ -13,6 +13,8 @@ from tomlkit import value
 from comfybridge.core.io_utils import qimage_to_numpy, numpy_to_qimage
 from comfybridge.core.maya_bridge import is_maya_running
 from comfybridge.core.generate_model import generate_3d_model
+from comfybridge.core.triposr_daemon import DAEMON_ENABLED, start_daemon, stop_daemon
+from comfybridge.core.rembg_session import warm_up as warm_up_rembg
 
 # Image Viewer Widget
 
@@ -315,6 +317,15 @@ class MainWindow(QtWidgets.QWidget):
 def main():
     import sys
     app = QtWidgets.QApplication(sys.argv)
+
+    # load TripoSR in the background while the user draws the selection
+    if DAEMON_ENABLED:
+        start_daemon(wait=False)
+        # a worker this viewer started holds the model, it must not outlive
+        # the viewer; one started by another client keeps running
+        app.aboutToQuit.connect(stop_daemon)
+    warm_up_rembg()
+
     w = MainWindow()
     w.show()
     app.exec()
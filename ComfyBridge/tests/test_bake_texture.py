@@ -0,0 +1,112 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip("torch")
+for module in ("einops", "omegaconf", "imageio", "rembg", "xatlas"):
+    pytest.importorskip(module)
+trimesh = pytest.importorskip("trimesh")
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "src", "comfybridge", "models", "TripoSR"
+    ),
+)
+
+from tsr import bake_texture  # noqa: E402
+from tsr.bake_texture import (  # noqa: E402
+    rasterize_position_atlas_numpy,
+    rasterize_position_tiles_numpy,
+)
+
+TEXTURE_RESOLUTION = 256
+TEXTURE_PADDING = 2
+
+
+def grid_atlas(mesh, texture_resolution, texture_padding):
+    # every face in its own cell of a square grid, in the lower-left half,
+    # a stand-in for xatlas with the same vmapping, indices and uvs layout
+    n_faces = len(mesh.faces)
+    n = int(np.ceil(np.sqrt(n_faces)))
+    cell = 1.0 / n
+    margin = 1.5 * texture_padding / texture_resolution
+    x0 = (np.arange(n_faces) % n) * cell + margin
+    y0 = (np.arange(n_faces) // n) * cell + margin
+    x1, y1 = x0 + cell - 2 * margin, y0 + cell - 2 * margin
+    uvs = np.stack(
+        [np.stack([x0, y0], -1), np.stack([x1, y0], -1), np.stack([x0, y1], -1)],
+        axis=1,
+    )
+    return {
+        "vmapping": mesh.faces.reshape(-1).astype(np.uint32),
+        "indices": np.arange(n_faces * 3, dtype=np.uint32).reshape(n_faces, 3),
+        "uvs": uvs.reshape(-1, 2).astype(np.float32),
+    }
+
+
+def sphere_and_atlas():
+    mesh = trimesh.creation.icosphere(subdivisions=2, radius=0.5)
+    atlas = grid_atlas(mesh, TEXTURE_RESOLUTION, TEXTURE_PADDING)
+    return mesh, atlas
+
+
+def test_numpy_tiles_match_full_atlas():
+    mesh, atlas = sphere_and_atlas()
+    args = (
+        mesh,
+        atlas["vmapping"],
+        atlas["indices"],
+        atlas["uvs"],
+        TEXTURE_RESOLUTION,
+        TEXTURE_PADDING,
+    )
+    full = rasterize_position_atlas_numpy(*args)
+
+    rows = [(0, 100), (100, 200), (200, TEXTURE_RESOLUTION)]
+    tiles = list(rasterize_position_tiles_numpy(*args, rows))
+
+    assert [tile.shape[0] for tile in tiles] == [100, 100, 56]
+    np.testing.assert_array_equal(np.concatenate(tiles), full)
+    # covered texels hold points of the mesh, the faces lie inside the sphere
+    covered = full[..., 3] > 0
+    assert 0.2 < covered.mean() < 1.0
+    radii = np.linalg.norm(full[covered][:, :3], axis=-1)
+    assert radii.min() > 0.45 and radii.max() < 0.5 + 1e-5
+
+
+class PositionColorModel:
+    """Stands in for TSR in the bake: colour is the position mapped to [0, 1]."""
+
+    class Renderer:
+        def query_triplane(self, decoder, positions, triplane):
+            return {"color": (positions + 0.5).clamp(0, 1)}
+
+    def __init__(self):
+        self.renderer = self.Renderer()
+        self.decoder = None
+
+
+def test_tiled_bake_matches_full_bake(tmp_path, monkeypatch):
+    mesh, atlas = sphere_and_atlas()
+    monkeypatch.setattr(bake_texture, "make_atlas", lambda *args: atlas)
+    # no GL context, both bakes use the numpy rasterizer
+    monkeypatch.setattr(bake_texture, "_gl_unavailable", True)
+    model, scene_code = PositionColorModel(), torch.zeros(3, 1, 1, 1)
+
+    full = bake_texture.bake_texture(mesh, model, scene_code, TEXTURE_RESOLUTION)
+    texture_path = str(tmp_path / "texture.png")
+    tiled = bake_texture.bake_texture_tiled(
+        mesh, model, scene_code, TEXTURE_RESOLUTION, texture_path, tile_size=100
+    )
+
+    assert "colors" not in tiled
+    for k in ("vmapping", "indices", "uvs"):
+        np.testing.assert_array_equal(tiled[k], full[k])
+    # saved flipped, like the full bake texture
+    texture = np.array(Image.open(texture_path))
+    assert texture.shape == (TEXTURE_RESOLUTION, TEXTURE_RESOLUTION, 4)
+    np.testing.assert_array_equal(texture, full["colors"][::-1])
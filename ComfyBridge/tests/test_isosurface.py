@@ -0,0 +1,98 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+mcubes = pytest.importorskip("mcubes")
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "src", "comfybridge", "models", "TripoSR"
+    ),
+)
+
+from tsr.models.isosurface import (  # noqa: E402
+    MarchingCubeHelper,
+    marching_cubes_blocks,
+)
+
+RESOLUTION = 41
+
+
+def sphere_level(points):
+    # positive inside a sphere off the grid centre, so no vertex is degenerate
+    center = torch.tensor([0.52, 0.47, 0.5])
+    return 0.3 - (points - center).norm(dim=-1, keepdim=True)
+
+
+def canonical_triangles(t_pos_idx):
+    # rotated to start at their smallest index, which keeps the winding
+    t_pos_idx = np.asarray(t_pos_idx, dtype=np.int64)
+    shift = t_pos_idx.argmin(axis=1)[:, None]
+    rolled = np.take_along_axis(t_pos_idx, (np.arange(3) + shift) % 3, axis=1)
+    return rolled[np.lexsort(rolled.T[::-1])]
+
+
+def assert_same_mesh(mesh, reference):
+    # same vertices up to float rounding, and the same triangles over them
+    v_pos, t_pos_idx = mesh
+    v_ref, t_ref = reference
+    assert v_pos.shape == v_ref.shape
+    dist, nearest = torch.cdist(
+        v_pos, v_ref, compute_mode="donot_use_mm_for_euclid_dist"
+    ).min(dim=1)
+    assert dist.max() < 1e-5
+    assert nearest.unique().numel() == v_ref.shape[0]
+    np.testing.assert_array_equal(
+        canonical_triangles(nearest[t_pos_idx.long()].numpy()),
+        canonical_triangles(t_ref.numpy()),
+    )
+
+
+def dense_mesh(helper):
+    return helper(sphere_level(helper.grid_vertices))
+
+
+def test_adaptive_level_matches_dense():
+    helper = MarchingCubeHelper(RESOLUTION)
+    reference = dense_mesh(helper)
+
+    n_queried = []
+
+    def query_level(points):
+        n_queried.append(points.shape[0])
+        return sphere_level(points)
+
+    level = helper.adaptive_level(query_level, base_cells=8)
+
+    assert sum(n_queried) < RESOLUTION**3
+    assert_same_mesh(helper(level), reference)
+
+
+@pytest.mark.parametrize("slab_size", [1, 7, 64])
+def test_stream_matches_dense(slab_size):
+    helper = MarchingCubeHelper(RESOLUTION)
+    mesh = helper.stream(sphere_level, slab_size=slab_size)
+    assert_same_mesh(mesh, dense_mesh(helper))
+
+
+@pytest.mark.parametrize("num_workers", [2, 3])
+def test_blocks_match_dense(num_workers):
+    helper = MarchingCubeHelper(RESOLUTION)
+    level = sphere_level(helper.grid_vertices)
+    assert_same_mesh(helper(level, num_workers), dense_mesh(helper))
+
+
+def test_blocks_keep_vertex_order():
+    volume = -sphere_level(MarchingCubeHelper(RESOLUTION).grid_vertices)
+    volume = volume.view(RESOLUTION, RESOLUTION, RESOLUTION).numpy()
+    v_pos, _ = marching_cubes_blocks(volume, 2)
+    # the first block comes first and unchanged, later ones only lose the
+    # vertices welded on the plane they share with the previous block
+    n_blocks = 4  # two per worker
+    stop = np.linspace(0, RESOLUTION - 1, n_blocks + 1).round().astype(int)[1]
+    v_first, _ = mcubes.marching_cubes(volume[: stop + 1], 0.0)
+    np.testing.assert_array_equal(v_pos[: v_first.shape[0]], v_first)
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+for module in ("einops", "omegaconf", "imageio", "rembg", "trimesh"):
+    pytest.importorskip(module)
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "src", "comfybridge", "models", "TripoSR"
+    ),
+)
+
+from tsr.models.nerf_renderer import TriplaneNeRFRenderer  # noqa: E402
+from tsr.utils import get_spherical_cameras  # noqa: E402
+
+RADIUS = 0.87
+PLANE_SIZE = 32
+
+
+class SphereDecoder(torch.nn.Module):
+    """Density from channel 0 of each plane, colour from channels 1 to 3."""
+
+    def forward(self, features):
+        density = features[..., 0] + features[..., 4] + features[..., 8]
+        return {"density": density[..., None], "features": features[..., 1:4]}
+
+
+def small_sphere_triplane(sphere_radius=0.25):
+    # planes summing to a dense ball well inside the bounding box
+    axis = torch.linspace(-1, 1, PLANE_SIZE) * RADIUS
+    yy, xx = torch.meshgrid(axis, axis, indexing="ij")
+    triplane = torch.zeros(3, 4, PLANE_SIZE, PLANE_SIZE)
+    triplane[:, 0] = 10.0 * (xx**2 + yy**2 < sphere_radius**2).float() - 10.0
+    triplane[:, 1:] = 0.5
+    return triplane
+
+
+def render(renderer, occupancy_grid=None):
+    rays_o, rays_d = get_spherical_cameras(4, 0.0, 1.9, 40.0, 16, 16)
+    decoder, triplane = SphereDecoder(), small_sphere_triplane()
+    if occupancy_grid:
+        occupancy_grid = renderer.build_occupancy_grid(decoder, triplane)
+    with torch.no_grad():
+        return renderer(
+            decoder,
+            triplane[None],
+            rays_o[None],
+            rays_d[None],
+            occupancy_grid=None if occupancy_grid is None else occupancy_grid[None],
+        )
+
+
+def make_renderer():
+    return TriplaneNeRFRenderer(
+        {
+            "radius": RADIUS,
+            "density_activation": "exp",
+            "density_bias": 0.0,
+            "num_samples_per_ray": 64,
+        }
+    )
+
+
+def test_block_compositing_with_occupancy_grid_and_missing_rays():
+    reference = render(make_renderer())
+
+    renderer = make_renderer()
+    renderer.set_occupancy_grid(64)
+    renderer.set_early_termination(1e-3)
+    comp_rgb = render(renderer, occupancy_grid=True)
+
+    assert comp_rgb.shape == reference.shape
+    assert torch.isfinite(comp_rgb).all()
+    # the ball covers the middle of every view, the corners see background
+    assert (reference < 0.999).any() and (reference[..., 0, 0, :] > 0.999).all()
+    assert torch.allclose(comp_rgb, reference, atol=1e-2)
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip("torch")
+for module in ("einops", "omegaconf", "imageio", "rembg", "trimesh"):
+    pytest.importorskip(module)
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "src", "comfybridge", "models", "TripoSR"
+    ),
+)
+
+from tsr.utils import PNGWriter, chunk_batch  # noqa: E402
+
+
+def query(x, scale=1.0):
+    return {"features": x * scale, "norm": x.norm(dim=-1, keepdim=True)}
+
+
+def test_chunk_batch_writes_into_out():
+    x = torch.randn(1000, 8)
+    reference = query(x, scale=2.0)
+
+    out = {"features": torch.empty(1000, 8), "norm": torch.empty(1000, 1)}
+    result = chunk_batch(query, 96, x, out=out, scale=2.0)
+
+    for k, v in reference.items():
+        assert result[k].data_ptr() == out[k].data_ptr()
+        assert torch.equal(result[k], v)
+    # allocated from the first chunk without out, for tuples too
+    features, norm = chunk_batch(lambda x: tuple(query(x).values()), 96, x)
+    assert torch.equal(features, x) and torch.equal(norm, reference["norm"])
+    with pytest.raises(ValueError):
+        chunk_batch(query, 96, x, out={k: v[:500] for k, v in out.items()})
+
+
+@pytest.mark.parametrize("num_workers", [2, 4])
+def test_chunk_batch_workers_match_serial(num_workers):
+    x = torch.randn(1000, 8)
+    reference = chunk_batch(query, 96, x, scale=2.0)
+
+    result = chunk_batch(query, 96, x, num_workers=num_workers, scale=2.0)
+    out = {"features": torch.empty(1000, 8), "norm": torch.empty(1000, 1)}
+    chunk_batch(query, 96, x, out=out, num_workers=num_workers, scale=2.0)
+
+    for k, v in reference.items():
+        assert torch.equal(result[k], v)
+        assert torch.equal(out[k], v)
+    # fewer rows than workers
+    small = chunk_batch(query, 96, x[:3], num_workers=num_workers, scale=2.0)
+    assert torch.equal(small["features"], reference["features"][:3])
+    # not one output row per input row, run serially
+    every_other = chunk_batch(lambda x: x[::2], 96, x, num_workers=num_workers)
+    assert torch.equal(every_other, x[::2])
+
+
+@pytest.mark.parametrize("channels", [3, 4])
+def test_png_writer_round_trips_through_pil(tmp_path, channels):
+    # smooth gradients and noise, so every row filter gets picked somewhere
+    height, width = 150, 97
+    yy, xx = np.mgrid[:height, :width]
+    image = np.random.default_rng(0).integers(0, 256, (height, width, channels))
+    image[: height // 2] = ((xx + 2 * yy)[: height // 2, :, None] * 3) % 256
+    image = image.astype(np.uint8)
+
+    path = str(tmp_path / "image.png")
+    with PNGWriter(path, width, height, channels=channels, filter_rows=16) as writer:
+        # uneven bands, one of a single row
+        bounds = [0, 40, 41, 100, height]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            writer.write(image[start:stop])
+        with pytest.raises(ValueError):
+            writer.write(image[:1])
+
+    with Image.open(path) as png:
+        assert png.mode == {3: "RGB", 4: "RGBA"}[channels]
+        np.testing.assert_array_equal(np.array(png), image)